@@ -7,7 +7,24 @@ import zipfile
 import os
 import subprocess
 import logging
-
+import functools
+import cProfile
+import pstats
+import tracemalloc
+import io
+import re
+import hashlib
+import shutil
+import threading
+import pickle
+import zlib
+import fnmatch
+import time
+import datetime
+import ipaddress
+
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from botocore.exceptions import ClientError
 
 from extutil import remove_none_attributes, account_context, ExtensionHandler, ext, \
@@ -22,6 +39,83 @@ client = boto3.client('elbv2')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Teardown tuning. We poll for the load balancer listeners/rules to let go of the target group,
+# then deregister its targets in parallel chunks and delete it.
+DEREGISTER_CHUNK_SIZE = 100
+TEARDOWN_MAX_WORKERS = 8
+LISTENER_DETACHMENT_BASE_SEC = 2
+LISTENER_DETACHMENT_MAX_SEC = 30
+LISTENER_DETACHMENT_MAX_POLLS = 40
+
+# Health snapshot published in props so consumers don't each poll describe_target_health
+HEALTH_SNAPSHOT_DEFAULT_TTL_SEC = 60
+HEALTH_SNAPSHOT_TOP_REASONS = 5
+# EC2 filters take at most 200 values
+AZ_LOOKUP_BATCH_SIZE = 200
+ec2_client = None
+
+# Opt-in profiling of every op. Turn on with PROFILE_OPS=true on the function or "profile": true in the event.
+PROFILE_OPS_DEFAULT = os.environ.get("PROFILE_OPS", "").lower() in ("1", "true")
+PROFILE_TOP_N = int(os.environ.get("PROFILE_TOP_N") or 15)
+PROFILE_DIR = "/tmp/profiles"
+# Each profiled op writes a .prof and a .txt, only the newest are kept
+PROFILE_KEEP_FILES = int(os.environ.get("PROFILE_KEEP_FILES") or 40)
+# cProfile only sees the calling thread. These ops hand their AWS calls to thread pools, so their hotspots are mostly lock waits.
+THREAD_POOL_OPS = ["deploy_regions", "delete_regions", "inventory_target_groups", "sweep_orphaned_target_groups", "deregister_all_targets"]
+profiling_enabled = PROFILE_OPS_DEFAULT
+
+# Opt-in invocation traces for offline replay (see trace_replay.py). Turn on with TRACE_INVOCATIONS=true or "trace": true in the event.
+TRACE_INVOCATIONS_DEFAULT = os.environ.get("TRACE_INVOCATIONS", "").lower() in ("1", "true")
+TRACE_DIR = "/tmp/traces"
+TRACE_KEEP_FILES = int(os.environ.get("TRACE_KEEP_FILES") or 20)
+# Every trace record is also printed to the log stream behind this marker, so traces outlive the container.
+# CloudWatch cuts log events at 256KB, so larger records are logged without their response.
+TRACE_LOG_MARKER = "TRACE_RECORD"
+TRACE_LOG_MAX_LINE_BYTES = 250000
+REDACTED_KEY_PATTERN = re.compile(r"secret|password|passwd|token|credential|authorization|private_key|api_key", re.IGNORECASE)
+active_trace = None
+
+# Optional warm-container cache of describe results in /tmp, keyed by region and target group.
+# Off unless describe_cache_ttl_seconds is set in the definition or DESCRIBE_CACHE_TTL_SECONDS on the function.
+DESCRIBE_CACHE_DIR = "/tmp/describe_cache"
+DESCRIBE_CACHE_TTL_DEFAULT = int(os.environ.get("DESCRIBE_CACHE_TTL_SECONDS") or 0)
+DESCRIBE_CACHE_MAX_BYTES = int(os.environ.get("DESCRIBE_CACHE_MAX_BYTES") or 16 * 1024 * 1024)
+describe_cache_ttl_seconds = DESCRIBE_CACHE_TTL_DEFAULT
+
+# These can only be set when the target group is created
+NON_MODIFIABLE_ATTRIBUTES = ["Name", "Protocol", "ProtocolVersion", "Port", "VpcId", "TargetType", "Tags", "IpAddressType"]
+
+# Errors the single region ops fail on straight away, since sending the same definition again can't fix them
+PERMANENT_REGION_ERROR_CODES = [
+    "DuplicateTargetGroupName", "TooManyTargetGroups", "InvalidConfigurationRequest", "TooManyTags", "DuplicateTagKeys",
+    "InvalidTarget", "TooManyTargets", "TooManyRegistrationsForTargetId", "ValidationError"
+]
+
+# One elbv2 client per region for multi-region deployments, reused by warm containers
+regional_clients = {}
+regional_clients_lock = threading.Lock()
+
+# describe_account_limits, the target group count and per load balancer target counts, cached per region for the life of the container
+ACCOUNT_LIMITS_TTL_SEC = int(os.environ.get("ACCOUNT_LIMITS_TTL_SECONDS") or 300)
+TARGETS_LIMIT_BY_PROTOCOL = {
+    "HTTP": "targets-per-application-load-balancer",
+    "HTTPS": "targets-per-application-load-balancer",
+    "TCP": "targets-per-network-load-balancer",
+    "TLS": "targets-per-network-load-balancer",
+    "UDP": "targets-per-network-load-balancer",
+    "TCP_UDP": "targets-per-network-load-balancer"
+}
+account_limits_cache = {}
+
+# describe_tags takes at most 20 ARNs, and attribute/health reads for adoption go out 20 at a time
+INVENTORY_BATCH_SIZE = 20
+
+# Orphan sweeping. Pages are kept small so a page's deletes fit comfortably in what's left of the invocation.
+SWEEP_PAGE_SIZE = 100
+SWEEP_DEFAULT_DELETES_PER_SEC = 2
+SWEEP_TIME_RESERVE_MS = 30000
+SWEEP_REPORT_MAX_NAMES = 200
+
 """
 eh calls
     eh.add_op() call MUST be made for the function to execute! Adds functions to the execution queue.
@@ -44,6 +138,7 @@ There are three elements of state preserved across retries:
     - eh.state 
 Wrap all operations you want to run with the following:
     @ext(handler=eh, op="your_operation_name")
+    @profiled   <- directly underneath, so the op can be profiled with PROFILE_OPS=true or "profile": true in the event
 Progress only needs to be explicitly reported on 1) a retry 2) an error. Finishing auto-sets progress to 100. 
 """
 
@@ -60,8 +155,251 @@ def run_command(command):
     logger.info("Command output:\n---\n{}\n---".format(result.stdout.decode('UTF-8')))
     return result
 
+def profiled(f):
+    # Sits under @ext so it only wraps ops that actually run. When profiling is off this is a single flag check.
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        if not profiling_enabled:
+            return f(*args, **kwargs)
+        return run_profiled(f, args, kwargs)
+    return wrapper
+
+def run_profiled(f, args, kwargs):
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(f, *args, **kwargs)
+    finally:
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        if started_tracing:
+            tracemalloc.stop()
+        report_profile(f.__name__, profiler, peak_bytes, snapshot)
+
+def report_profile(op, profiler, peak_bytes, snapshot):
+    try:
+        stats = pstats.Stats(profiler)
+        hotspots = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:PROFILE_TOP_N]
+        # The snapshot is taken once the op returns, so this is the largest allocation still alive then.
+        # It is not necessarily what drove the peak, which tracemalloc doesn't attribute to a site.
+        allocation_sites = snapshot.statistics("lineno")
+        largest_live_allocation = allocation_sites[0] if allocation_sites else None
+
+        report = {
+            "peak_memory_bytes": peak_bytes,
+            "largest_live_allocation_site": str(largest_live_allocation.traceback) if largest_live_allocation else None,
+            "largest_live_allocation_bytes": largest_live_allocation.size if largest_live_allocation else None,
+            "profiled_threads": "calling thread only, work done in the op's thread pool shows up as lock waits" if op in THREAD_POOL_OPS else "calling thread only",
+            "hotspots": [{
+                "function": f"{filename}:{line}({name})",
+                "calls": calls,
+                "own_ms": round(own_time * 1000, 2),
+                "cumulative_ms": round(cumulative_time * 1000, 2)
+            } for (filename, line, name), (_, calls, own_time, cumulative_time, _) in hotspots]
+        }
+        eh.add_log(f"Profile: {op}", report)
+
+        # Full stats go to /tmp so they can be pulled with snakeviz/pstats from a warm container
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profile_path = os.path.join(PROFILE_DIR, f"{op}-{current_epoch_time_usec_num()}")
+        profiler.dump_stats(f"{profile_path}.prof")
+        text_report = io.StringIO()
+        pstats.Stats(profiler, stream=text_report).sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+        with open(f"{profile_path}.txt", "w") as f:
+            f.write(text_report.getvalue())
+        prune_directory(PROFILE_DIR, PROFILE_KEEP_FILES)
+        logger.info(f"Profile for {op} written to {profile_path}.prof, peak memory {peak_bytes} bytes\n{text_report.getvalue()}")
+    # Profiling must never break a deployment
+    except Exception as e:
+        logger.warning(f"Could not write profile for {op}: {e}")
+
+def prune_directory(path, keep):
+    # Warm containers keep /tmp between invocations, so drop the oldest files beyond the newest `keep`
+    entries = sorted((entry for entry in os.scandir(path) if entry.is_file()), key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in entries[keep:]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+def redact(value):
+    if isinstance(value, dict):
+        # Tags come as {"Key": ..., "Value": ...} pairs, so the secret-looking name is in a sibling value, not the dict key
+        secret_tag = isinstance(value.get("Key"), str) and REDACTED_KEY_PATTERN.search(value.get("Key")) and "Value" in value
+        return {k: ("**REDACTED**" if (isinstance(k, str) and REDACTED_KEY_PATTERN.search(k)) or (secret_tag and k == "Value") else redact(v)) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    return value
+
+def trace_call_started(region, params, model, context, **kwargs):
+    if active_trace is not None:
+        context["trace_started_usec"] = current_epoch_time_usec_num()
+        context["trace_params"] = redact(params)
+
+def trace_call_finished(region, http_response, parsed, model, context, **kwargs):
+    if active_trace is None or "trace_started_usec" not in context:
+        return
+    record = {
+        "type": "call",
+        # Regions run concurrently, so replay needs to know which region's recording a call belongs to
+        "region": region,
+        "operation": botocore.xform_name(model.name),
+        "params": context.pop("trace_params"),
+        "duration_ms": round((current_epoch_time_usec_num() - context.pop("trace_started_usec")) / 1000, 2)
+    }
+    if parsed.get("Error"):
+        record["error"] = parsed.get("Error")
+        record["status_code"] = http_response.status_code
+    else:
+        record["response"] = redact({k: v for k, v in parsed.items() if k != "ResponseMetadata"})
+    active_trace.append(record)
+
+# The hooks are no-ops unless a trace is active for the current invocation
+client.meta.events.register("provide-client-params", functools.partial(trace_call_started, client.meta.region_name))
+client.meta.events.register("after-call", functools.partial(trace_call_finished, client.meta.region_name))
+
+def target_group_name_from_arn(target_group_arn):
+    # arn:aws:elasticloadbalancing:region:account:targetgroup/name/id
+    return target_group_arn.split(":")[-1].split("/")[1]
+
+def describe_cache_dir(region, target_group_name):
+    return os.path.join(DESCRIBE_CACHE_DIR, hashlib.sha1(f"{region}/{target_group_name}".encode()).hexdigest())
+
+def describe_cache_path(region, operation, target_group_name, params):
+    params_key = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+    return os.path.join(describe_cache_dir(region, target_group_name), f"{operation}-{params_key}.bin")
+
+def cached_describe(describe_client, operation, target_group_name, **params):
+    if not describe_cache_ttl_seconds:
+        return getattr(describe_client, operation)(**params)
+
+    # Keyed by the region of the client that serves the call
+    cache_path = describe_cache_path(describe_client.meta.region_name, operation, target_group_name, params)
+    now = current_epoch_time_usec_num() // 1000000
+    try:
+        with open(cache_path, "rb") as f:
+            stored_at, response = pickle.loads(zlib.decompress(f.read()))
+        if now - stored_at < describe_cache_ttl_seconds:
+            # Touch the entry so size eviction drops the least recently used ones first
+            os.utime(cache_path)
+            return response
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError, zlib.error):
+        pass
+
+    response = getattr(describe_client, operation)(**params)
+    store_describe_cache_entry(cache_path, response)
+    return response
+
+def store_describe_cache_entry(cache_path, response):
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path, "wb") as f:
+            f.write(zlib.compress(pickle.dumps((current_epoch_time_usec_num() // 1000000, response), protocol=pickle.HIGHEST_PROTOCOL)))
+        evict_describe_cache()
+    except OSError as e:
+        logger.warning(f"Could not write describe cache entry: {e}")
+
+def evict_describe_cache():
+    entries = []
+    for root, _, files in os.walk(DESCRIBE_CACHE_DIR):
+        for filename in files:
+            path = os.path.join(root, filename)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total_bytes = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_bytes <= DESCRIBE_CACHE_MAX_BYTES:
+            break
+        os.remove(path)
+        total_bytes -= size
+
+def track_describe_cache_write(region, params, model, context, **kwargs):
+    # Only attribute changes and deletes affect what is cached, so only those are followed up on once the response is in.
+    # That happens even when this deployment has the cache off, since an earlier one in this container may have filled it.
+    if model.name not in ("ModifyTargetGroupAttributes", "DeleteTargetGroup") or not params.get("TargetGroupArn"):
+        return
+    if os.path.isdir(describe_cache_dir(region, target_group_name_from_arn(params["TargetGroupArn"]))):
+        context["describe_cache_target_group_arn"] = params["TargetGroupArn"]
+
+def update_describe_cache(region, http_response, parsed, model, context, **kwargs):
+    target_group_arn = context.pop("describe_cache_target_group_arn", None)
+    if not target_group_arn:
+        return
+    target_group_name = target_group_name_from_arn(target_group_arn)
+    if model.name == "DeleteTargetGroup":
+        shutil.rmtree(describe_cache_dir(region, target_group_name), ignore_errors=True)
+        return
+
+    cache_path = describe_cache_path(region, "describe_target_group_attributes", target_group_name, {"TargetGroupArn": target_group_arn})
+    if parsed.get("Error") or not describe_cache_ttl_seconds:
+        # A failed write leaves the attributes unknown, and with the cache off nothing new is stored, so read them fresh next time
+        try:
+            os.remove(cache_path)
+        except OSError:
+            pass
+    else:
+        # The response lists every attribute after the change, which is what the next describe would return
+        store_describe_cache_entry(cache_path, {"Attributes": parsed.get("Attributes", [])})
+
+# Bound to the client's region, since the hooks themselves aren't told which client emitted them
+client.meta.events.register("provide-client-params", functools.partial(track_describe_cache_write, client.meta.region_name))
+client.meta.events.register("after-call", functools.partial(update_describe_cache, client.meta.region_name))
+
+def write_trace(event, context, result, started_usec):
+    trace_id = getattr(context, 'aws_request_id', None) or started_usec
+    os.makedirs(TRACE_DIR, exist_ok=True)
+    trace_path = os.path.join(TRACE_DIR, f"{trace_id}.jsonl")
+    records = [{
+        "type": "invocation",
+        "event": redact(event),
+        "pass_back_data": redact(event.get("pass_back_data") or {}),
+        "function_arn": getattr(context, "invoked_function_arn", None),
+        "started_usec": started_usec
+    }] + active_trace + [{
+        "type": "result",
+        "duration_ms": round((current_epoch_time_usec_num() - started_usec) / 1000, 2),
+        "result": redact(result)
+    }]
+    lines = [json.dumps(record, separators=(",", ":"), default=str) for record in records]
+    with open(trace_path, "w") as f:
+        for line in lines:
+            f.write(line + "\n")
+    prune_directory(TRACE_DIR, TRACE_KEEP_FILES)
+
+    # One log line per record, pulled back out with trace_replay.py --from-logs
+    for record, line in zip(records, lines):
+        if len(line) > TRACE_LOG_MAX_LINE_BYTES:
+            line = json.dumps({**{k: v for k, v in record.items() if k not in ("response", "event", "result")}, "truncated": True}, separators=(",", ":"), default=str)
+        print(f"{TRACE_LOG_MARKER} {trace_id} {line}")
+    logger.info(f"Invocation trace with {len(active_trace)} elbv2 calls written to {trace_path} and the log stream")
+
 def lambda_handler(event, context):
+    global active_trace
+    if not (TRACE_INVOCATIONS_DEFAULT or event.get("trace")):
+        return handle_event(event, context)
+
+    active_trace = []
+    started_usec = current_epoch_time_usec_num()
+    result = None
+    try:
+        result = handle_event(event, context)
+        return result
+    finally:
+        try:
+            write_trace(event, context, result, started_usec)
+        # A failed trace write must never fail the deployment
+        except Exception as e:
+            logger.warning(f"Could not write invocation trace: {e}")
+        active_trace = None
+
+def handle_event(event, context):
+    global profiling_enabled, describe_cache_ttl_seconds
     try:
+        profiling_enabled = PROFILE_OPS_DEFAULT or bool(event.get("profile"))
+
         # All relevant data is generally in the event, excepting the region and account number
         print(f"event = {event}")
         region = account_context(context)['region']
@@ -110,6 +448,32 @@ def lambda_handler(event, context):
         ### Targets for the target group
         targets = cdef.get('targets')
 
+        ### Find existing target groups to adopt instead of deploying one, e.g. {"web": {"name_pattern": "web-*"}, "api": {"tags": {"service": "api"}}}
+        inventory = cdef.get('inventory')
+
+        ### Delete orphaned target groups instead of deploying one, e.g. {"owner_tags": {"env": "preview"}, "created_at_tag": "created_at", "min_age_hours": 24, "dry_run": true}
+        sweeper = cdef.get('sweeper')
+
+        ### Deploy the same definition to several regions at once, e.g. ["us-east-1", {"region": "eu-west-1", "vpc_id": "vpc-..."}]
+        regions = None
+        if cdef.get('regions'):
+            regions = {}
+            for item in cdef.get('regions'):
+                if isinstance(item, str):
+                    regions[item] = {}
+                else:
+                    regions[item.get("region")] = remove_none_attributes({"vpc_id": item.get("vpc_id")})
+
+        ### Opt-in /tmp cache for the describe calls made while reading the current state
+        describe_cache_ttl_seconds = cdef.get('describe_cache_ttl_seconds')
+        if describe_cache_ttl_seconds is None:
+            describe_cache_ttl_seconds = DESCRIBE_CACHE_TTL_DEFAULT
+
+        ### How long a published health snapshot may be reused before it is re-read
+        health_snapshot_ttl_seconds = cdef.get('health_snapshot_ttl_seconds')
+        if health_snapshot_ttl_seconds is None:
+            health_snapshot_ttl_seconds = HEALTH_SNAPSHOT_DEFAULT_TTL_SEC
+
         ### SPECIAL ATTRIBUTES THAT CAN ONLY BE ADDED POST INITIAL CREATION
         # supported by all load balancers
         deregistration_delay_timeout_seconds = cdef.get('deregistration_delay_timeout_seconds')
@@ -269,47 +633,59 @@ def lambda_handler(event, context):
         # If NOT retrying, and we are instead upserting, then we start with the GET STATE call
         elif event.get("op") == "upsert":
 
-            old_name = None
-            old_protocol = None
-            old_protocol_version = None
-            old_port = None
-            old_vpc_id = None
-            old_target_type = None
-            old_ip_address_type = None
-
-            try:
-                old_name = prev_state["props"]["name"]
-                old_protocol = prev_state["props"]["protocol"]
-                old_protocol_version = prev_state["props"]["protocol_version"]
-                old_port = prev_state["props"]["port"]
-                old_vpc_id = prev_state["props"]["vpc_id"]
-                old_target_type = prev_state["props"]["target_type"]
-                old_ip_address_type = prev_state["props"]["ip_address_type"]
-            except:
-                pass
-
-            eh.add_op("get_target_group")
+            if inventory:
+                eh.add_op("inventory_target_groups", inventory)
+            elif sweeper:
+                eh.add_op("sweep_orphaned_target_groups", sweeper)
+            elif regions:
+                eh.add_op("deploy_regions", regions)
+                # Regions dropped from the list, or the home region when a single region component moves to regions, would otherwise be orphaned
+                dropped_regions = {region_name: region_props.get("arn") for region_name, region_props in prev_regions_from_props(prev_state.get("props", {})).items() if region_name not in regions and region_props.get("arn")}
+                if dropped_regions:
+                    eh.add_op("delete_regions", dropped_regions)
+            else:
+                eh.add_op("get_target_group")
+                eh.add_op("preflight_quota_check")
+                # Going back to a single region, the home region's group is picked up by name and the others are removed
+                dropped_regions = {region_name: region_props.get("arn") for region_name, region_props in (prev_state.get("props", {}).get("regions") or {}).items() if region_name != region and region_props.get("arn")}
+                if dropped_regions:
+                    eh.add_op("delete_regions", dropped_regions)
+
+            # vpc_id is not required by the schema, since inventory and sweeper runs never deploy a target group and lambda targets take none
+            if not (inventory or sweeper) and target_type != "lambda" and not vpc_id and \
+                not (regions and all(region_props.get("vpc_id") for region_props in regions.values())):
+                missing_vpc_id_message = "vpc_id is required to deploy a target group, either at the top level or on every entry of regions."
+                eh.add_log("Missing vpc_id", {"error": missing_vpc_id_message}, is_error=True)
+                eh.perm_error(missing_vpc_id_message, 0)
 
             # If any non-editable fields have changed, we are choosing to fail. 
             # We are NOT choosing to delete and recreate because a listener may be attached and that MUST be removed before the target group can be deleted. 
             # Therefore a switchover is necessary to change un-editable values.
-            if (old_name and old_name != name) or \
-                (old_protocol and old_protocol != protocol) or \
-                (old_protocol_version and old_protocol_version != protocol_version) or \
-                (old_port and old_port != port) or \
-                (old_vpc_id and old_vpc_id != vpc_id) or \
-                (old_target_type and old_target_type != target_type) or \
-                (old_ip_address_type and old_ip_address_type != ip_address_type):
-
+            changed_fields = changed_non_editable_fields(prev_state.get("props", {}), {
+                "name": name,
+                "protocol": protocol,
+                "protocol_version": protocol_version,
+                "port": port,
+                "vpc_id": vpc_id,
+                "target_type": target_type,
+                "ip_address_type": ip_address_type
+            }, regions)
+            if changed_fields:
                 non_editable_error_message = "You may not edit the name, protocol, protocol_version, port, vpc_id, target_type, or ip_address_type on an existing target_group. Please create a new component and associate the listener to your updated target group to get the desired configuration."
-                eh.add_log("Cannot edit non-editable field", {"error": non_editable_error_message}, is_error=True)
+                eh.add_log("Cannot edit non-editable field", {"error": non_editable_error_message, "changed": changed_fields}, is_error=True)
                 eh.perm_error(non_editable_error_message, 10)
 
         # If NOT retrying, and we are instead deleting, then we start with the DELETE call 
         #   (sometimes you start with GET STATE if you need to make a call for the identifier)
         elif event.get("op") == "delete":
-            eh.add_op("delete_target_group")
-            eh.add_state({"target_group_arn": prev_state["props"]["arn"]})
+            # Adopting or sweeping an existing estate doesn't make this component their owner
+            if prev_state.get("props", {}).get("inventory") is not None or prev_state.get("props", {}).get("sweep_report") is not None:
+                eh.add_log("Inventory or Sweeper Only, Nothing to Delete")
+            elif prev_state.get("props", {}).get("regions"):
+                eh.add_op("delete_regions", {region_name: region_props.get("arn") for region_name, region_props in prev_state["props"]["regions"].items()})
+            else:
+                eh.add_op("get_target_group_for_delete")
+                eh.add_state({"target_group_arn": prev_state["props"]["arn"], "region": region})
 
         # The ordering of call declarations should generally be in the following order
         # GET STATE
@@ -322,10 +698,18 @@ def lambda_handler(event, context):
         ### The eh.add_op() function MUST be called for actual execution of any of the functions. 
 
         ### GET STATE
+        inventory_target_groups()
+        sweep_orphaned_target_groups(context)
         get_target_group(name, attributes, formatted_targets, special_attributes, default_special_attributes, region, prev_state)
+        deploy_regions(attributes, formatted_targets, special_attributes, default_special_attributes, prev_state)
+        preflight_quota_check(formatted_targets, protocol)
 
         ### DELETE CALL(S)
+        get_target_group_for_delete()
+        wait_for_listener_detachment()
+        deregister_all_targets()
         delete_target_group()
+        delete_regions()
 
         ### CREATE CALL(S) (occasionally multiple)
         create_target_group(attributes, formatted_targets, special_attributes, default_special_attributes, region, prev_state)
@@ -340,6 +724,7 @@ def lambda_handler(event, context):
         reset_target_group_special_attributes(default_special_attributes)
 
         ### GENERATE PROPS (sometimes can be done in get/create)
+        refresh_target_health_snapshot(health_snapshot_ttl_seconds, prev_state)
 
         # IMPORTANT! ALWAYS include this. Sends back appropriate data to CloudKommand.
         return eh.finish()
@@ -360,8 +745,8 @@ def lambda_handler(event, context):
 # eh.add_props() is used to add useful bits of information that can be used by this component or other components to integrate with this.
 # eh.add_links() is used to add useful links to the console, the deployed infrastructure, the logs, etc that pertain to this component.
 @ext(handler=eh, op="get_target_group")
+@profiled
 def get_target_group(name, attributes, targets, special_attributes, default_special_attributes, region, prev_state):
-    client = boto3.client("elbv2")
 
     if prev_state and prev_state.get("props") and prev_state.get("props").get("name"):
         prev_name = prev_state.get("props").get("name")
@@ -371,6 +756,8 @@ def get_target_group(name, attributes, targets, special_attributes, default_spec
     
     # Try to get the target group. If you succeed, record the props and links from the current target group
     try:
+        # The lookup by name is never cached: another container may have deleted and recreated the group since,
+        # and a stale ARN would skip the create and send every update to a group that no longer exists
         response = client.describe_target_groups(Names=[name])
         target_group_to_use = None
         target_group_arn = None
@@ -399,20 +786,7 @@ def get_target_group(name, attributes, targets, special_attributes, default_spec
             # Figure out what targets needs to be removed and added and setup those actions
             prev_targets = prev_state.get("props", {}).get("targets")
 
-            targets_comparable = []
-            if targets:
-                targets_comparable = [f"{item.get('Id')}${item.get('Port', '')}${item.get('AvailabilityZone', '')}" for item in targets]
-
-            prev_targets_comparable= []
-            if prev_targets:
-                prev_targets_comparable = [f"{item.get('Id')}${item.get('Port', '')}${item.get('AvailabilityZone', '')}" for item in prev_targets]
-
-            prev_targets_to_remove = [prev_target.split("$")[0] for prev_target in prev_targets_comparable if prev_target not in targets_comparable]
-            targets_to_add = [remove_none_attributes({ \
-                "Id": def_target.split("$")[0], \
-                "Port": safe_cast(def_target.split("$")[1], int, def_target.split("$")[1]) or None, \
-                "AvailabilityZone": def_target.split("$")[2] or None \
-                }) for def_target in targets_comparable if def_target not in prev_targets_comparable]
+            targets_to_add, prev_targets_to_remove = diff_targets(targets, prev_targets)
             
             if targets_to_add:
                 eh.add_op("register_targets", targets_to_add)
@@ -421,18 +795,19 @@ def get_target_group(name, attributes, targets, special_attributes, default_spec
             
             # Update the target group
             eh.add_op("update_target_group")
+            eh.add_op("refresh_target_health_snapshot", {"targets_changed": bool(targets_to_add or prev_targets_to_remove)})
             
             # Figure out if there are special attributes that need to be set, otherwise reset all of the special attributes that exist current on the target group to their original values
             try:
                 
                 # Try to get the current special attributes
-                response = client.describe_target_group_attributes(TargetGroupArn=target_group_arn)
+                response = cached_describe(client, "describe_target_group_attributes", name, TargetGroupArn=target_group_arn)
                 eh.add_log("Got Target Group Special Attributes", response)
                 current_special_attributes = {item.get("Key"): item.get("Value") for item in response["Attributes"]}
 
                 if special_attributes:
                     # You either use whatever is being passed in or the default. That's it. And you only care about parameters that are allowed to be set for the current setup.
-                    update_attributes = {key: (special_attributes.get(key) or default_special_attributes.get(key)) for key, current_value in current_special_attributes.items() }
+                    update_attributes = special_attributes_to_write(special_attributes, default_special_attributes, current_special_attributes)
                     eh.add_state({"update_special_attributes": update_attributes})
                     eh.add_op("update_target_group_special_attributes")
 
@@ -445,7 +820,7 @@ def get_target_group(name, attributes, targets, special_attributes, default_spec
                 pass
 
             try:
-                # Try to get the current tags
+                # Try to get the current tags. Never cached: a stale read here would skip a tag write that is needed.
                 response = client.describe_tags(ResourceArns=[target_group_arn])
                 eh.add_log("Got Tags")
                 relevant_items = [item for item in response.get("TagDescriptions") if item.get("ResourceArn") == target_group_arn]
@@ -457,23 +832,12 @@ def get_target_group(name, attributes, targets, special_attributes, default_spec
                     if relevant_item.get("Tags"):
                         current_tags = {item.get("Key") : item.get("Value") for item in relevant_item.get("Tags")}
 
-                # If there are tags specified, figure out which ones need to be added and which ones need to be removed
-                if attributes.get("Tags"):
-
-                    tags = attributes.get("Tags")
-                    formatted_tags = {item.get("Key") : item.get("Value") for item in tags}
-                    # Compare the current tags to the desired tags
-                    if formatted_tags != current_tags:
-                        remove_tags = [k for k in current_tags.keys() if k not in formatted_tags]
-                        add_tags = {k:v for k,v in formatted_tags.items() if v != current_tags.get(k)}
-                        if remove_tags:
-                            eh.add_op("remove_tags", remove_tags)
-                        if add_tags:
-                            eh.add_op("set_tags", add_tags)
-                # If there are no tags specified, make sure to remove any straggler tags
-                else:
-                    if current_tags:
-                        eh.add_op("remove_tags", list(current_tags.keys()))
+                # Figure out which tags need to be added and which ones need to be removed. No tags specified removes any stragglers.
+                remove_tags, add_tags = diff_tags(attributes.get("Tags"), current_tags)
+                if remove_tags:
+                    eh.add_op("remove_tags", remove_tags)
+                if add_tags:
+                    eh.add_op("set_tags", add_tags)
 
             # If the target group does not exist, some wrong has happened. Probably don't permanently fail though, try to continue.
             except client.exceptions.TargetGroupNotFoundException:
@@ -497,7 +861,324 @@ def get_target_group(name, attributes, targets, special_attributes, default_spec
         return 0
 
             
+@ext(handler=eh, op="inventory_target_groups")
+@profiled
+def inventory_target_groups():
+    definitions = eh.ops.get("inventory_target_groups")
+    inventory = {definition_name: {} for definition_name in definitions}
+    scanned = 0
+
+    try:
+        for target_groups, _ in iter_target_group_pages():
+            scanned += len(target_groups)
+            # Name patterns are free to check, so only fetch tags for groups that could still match something
+            candidates = [target_group for target_group in target_groups if any(
+                fnmatch.fnmatchcase(target_group.get("TargetGroupName"), definition.get("name_pattern") or "*") for definition in definitions.values()
+            )]
+            tags_by_arn = describe_tags_batched([target_group.get("TargetGroupArn") for target_group in candidates])
+
+            matches = {}
+            for target_group in candidates:
+                definition_name = match_inventory_definition(target_group, tags_by_arn.get(target_group.get("TargetGroupArn"), {}), definitions)
+                if definition_name:
+                    matches[target_group.get("TargetGroupArn")] = (definition_name, target_group)
+
+            details_by_arn = describe_adoption_details_batched(list(matches))
+            for target_group_arn, (definition_name, target_group) in matches.items():
+                special_attributes, targets = details_by_arn[target_group_arn]
+                inventory[definition_name][target_group.get("TargetGroupName")] = {
+                    "name": target_group.get("TargetGroupName"),
+                    "arn": target_group_arn,
+                    "vpc_id": target_group.get("VpcId"),
+                    "port": target_group.get("Port"),
+                    "load_balancer_arns": target_group.get("LoadBalancerArns"),
+                    "protocol": target_group.get("Protocol"),
+                    "protocol_version": target_group.get("ProtocolVersion"),
+                    "target_type": target_group.get("TargetType"),
+                    "ip_address_type": target_group.get("IpAddressType"),
+                    "targets": targets,
+                    "tags": tags_by_arn.get(target_group_arn, {}),
+                    "special_attributes": special_attributes
+                }
+    except ClientError as e:
+        handle_common_errors(e, eh, "Error Building Target Group Inventory", progress=40)
+        return
+
+    eh.add_log("Built Target Group Inventory", {
+        "scanned": scanned,
+        "matched": {definition_name: len(target_groups) for definition_name, target_groups in inventory.items()}
+    })
+    eh.add_props({"inventory": inventory})
+
+def iter_target_group_pages(marker=None, page_size=400):
+    # Yields each page with the marker for the page after it, so callers can checkpoint between pages
+    while True:
+        params = remove_none_attributes({"PageSize": page_size, "Marker": marker})
+        response = client.describe_target_groups(**params)
+        marker = response.get("NextMarker")
+        yield response.get("TargetGroups", []), marker
+        if not marker:
+            return
+
+def describe_tags_batched(target_group_arns):
+    tags_by_arn = {}
+    for i in range(0, len(target_group_arns), INVENTORY_BATCH_SIZE):
+        response = client.describe_tags(ResourceArns=target_group_arns[i:i + INVENTORY_BATCH_SIZE])
+        for item in response.get("TagDescriptions", []):
+            tags_by_arn[item.get("ResourceArn")] = {tag.get("Key"): tag.get("Value") for tag in item.get("Tags", [])}
+    return tags_by_arn
+
+def describe_adoption_details_batched(target_group_arns):
+    # Attributes and health have no batch API, so they are read concurrently, a batch at a time
+    def describe_details(target_group_arn):
+        response = client.describe_target_group_attributes(TargetGroupArn=target_group_arn)
+        special_attributes = {item.get("Key"): item.get("Value") for item in response.get("Attributes", [])}
+        targets = [remove_none_attributes({
+            "Id": item.get("Target", {}).get("Id"),
+            "Port": item.get("Target", {}).get("Port"),
+            "AvailabilityZone": item.get("Target", {}).get("AvailabilityZone")
+        }) for item in iter_target_health(target_group_arn)]
+        return special_attributes, targets
+
+    details_by_arn = {}
+    with ThreadPoolExecutor(max_workers=INVENTORY_BATCH_SIZE) as executor:
+        for i in range(0, len(target_group_arns), INVENTORY_BATCH_SIZE):
+            batch = target_group_arns[i:i + INVENTORY_BATCH_SIZE]
+            details_by_arn.update(zip(batch, executor.map(describe_details, batch)))
+    return details_by_arn
+
+def match_inventory_definition(target_group, tags, definitions):
+    for definition_name, definition in definitions.items():
+        if not fnmatch.fnmatchcase(target_group.get("TargetGroupName"), definition.get("name_pattern") or "*"):
+            continue
+        if all(tags.get(key) == str(value) for key, value in (definition.get("tags") or {}).items()):
+            return definition_name
+    return None
+
+@ext(handler=eh, op="sweep_orphaned_target_groups")
+@profiled
+def sweep_orphaned_target_groups(context):
+    config = eh.ops.get("sweep_orphaned_target_groups")
+    dry_run = config.get("dry_run", True)
+    # Without both, a real sweep would match every empty, unattached target group in the region
+    if not dry_run and not (config.get("owner_tags") and config.get("min_age_hours")):
+        eh.add_log("Sweep Not Scoped", {"owner_tags": config.get("owner_tags"), "min_age_hours": config.get("min_age_hours")}, is_error=True)
+        eh.perm_error("A sweep with dry_run set to false needs non-empty owner_tags and a non-zero min_age_hours, so it only deletes target groups this team created. Run it with dry_run first to review what would be deleted.", 10)
+        return
+    rate_limiter = TokenBucket(config.get("deletes_per_second") or SWEEP_DEFAULT_DELETES_PER_SEC)
+    # Where the previous invocation stopped. A page is only marked done once all of its deletes went out.
+    checkpoint = eh.state.get("sweep_checkpoint") or {"marker": None, "scanned": 0, "orphans": 0, "orphan_names": [], "deleted": 0, "failed": {}}
+    # Orphans already handled on the page being worked through, so a page re-read after a checkpoint counts each group once
+    page_handled = checkpoint.setdefault("page_handled", [])
+
+    def save_checkpoint():
+        eh.add_state({"sweep_checkpoint": checkpoint})
+        eh.add_log("Sweep Checkpointed", {k: v for k, v in checkpoint.items() if k not in ("orphan_names", "page_handled")})
+        eh.retry_error(f"Sweep Checkpoint {checkpoint['scanned']}", progress=50, callback_sec=1)
+
+    try:
+        for target_groups, next_marker in iter_target_group_pages(marker=checkpoint["marker"], page_size=SWEEP_PAGE_SIZE):
+            unhandled_target_groups = [target_group for target_group in target_groups if target_group.get("TargetGroupName") not in page_handled]
+            for target_group in find_orphaned_target_groups(unhandled_target_groups, config):
+                # Out of time mid-page: the page is read again next time, without the groups we deleted and skipping the ones we tried
+                if not dry_run and context.get_remaining_time_in_millis() < SWEEP_TIME_RESERVE_MS:
+                    save_checkpoint()
+                    return
+                page_handled.append(target_group.get("TargetGroupName"))
+                checkpoint["orphans"] += 1
+                if len(checkpoint["orphan_names"]) < SWEEP_REPORT_MAX_NAMES:
+                    checkpoint["orphan_names"].append(target_group.get("TargetGroupName"))
+                if dry_run:
+                    continue
+                rate_limiter.acquire()
+                try:
+                    client.delete_target_group(TargetGroupArn=target_group.get("TargetGroupArn"))
+                    checkpoint["deleted"] += 1
+                    adjust_cached_target_group_count(client.meta.region_name, -1)
+                # Something started using it (or deleted it) since we looked, leave it be
+                except (client.exceptions.ResourceInUseException, client.exceptions.TargetGroupNotFoundException) as e:
+                    checkpoint["failed"][target_group.get("TargetGroupName")] = str(e)
+
+            # Deleted groups are missing from a re-read page, so they are counted from page_handled instead
+            checkpoint["scanned"] += len({target_group.get("TargetGroupName") for target_group in target_groups}.union(page_handled))
+            checkpoint["marker"] = next_marker
+            page_handled.clear()
+            if next_marker and context.get_remaining_time_in_millis() < SWEEP_TIME_RESERVE_MS:
+                save_checkpoint()
+                return
+    except ClientError as e:
+        eh.add_state({"sweep_checkpoint": checkpoint})
+        handle_common_errors(e, eh, "Error Sweeping Target Groups", progress=50)
+        return
+
+    sweep_report = {
+        "dry_run": dry_run,
+        "scanned": checkpoint["scanned"],
+        "orphans": checkpoint["orphans"],
+        "orphan_names": checkpoint["orphan_names"],
+        "deleted": checkpoint["deleted"],
+        "failed": checkpoint["failed"]
+    }
+    eh.add_state({"sweep_checkpoint": None})
+    eh.add_log("Swept Orphaned Target Groups", sweep_report)
+    eh.add_props({"sweep_report": sweep_report})
+
+def find_orphaned_target_groups(target_groups, config):
+    # Cheapest checks first: no load balancer and a matching name, then ownership/age from tags, then empty health
+    now = current_epoch_time_usec_num() // 1000000
+    min_age_sec = (config.get("min_age_hours") or 0) * 3600
+    candidates = [target_group for target_group in target_groups if not target_group.get("LoadBalancerArns") and \
+        fnmatch.fnmatchcase(target_group.get("TargetGroupName"), config.get("name_pattern") or "*")]
+    tags_by_arn = describe_tags_batched([target_group.get("TargetGroupArn") for target_group in candidates])
+
+    owned = []
+    for target_group in candidates:
+        tags = tags_by_arn.get(target_group.get("TargetGroupArn"), {})
+        if not all(tags.get(key) == str(value) for key, value in (config.get("owner_tags") or {}).items()):
+            continue
+        if min_age_sec:
+            # Target groups carry no creation time, so age comes from a tag. No readable tag means we can't tell, so keep it.
+            created_at = parse_epoch_seconds(tags.get(config.get("created_at_tag") or "created_at"))
+            if created_at is None or now - created_at < min_age_sec:
+                continue
+        owned.append(target_group)
+
+    def has_no_targets(target_group):
+        return next(iter_target_health(target_group.get("TargetGroupArn")), None) is None
+
+    with ThreadPoolExecutor(max_workers=INVENTORY_BATCH_SIZE) as executor:
+        empty_flags = list(executor.map(has_no_targets, owned))
+    return [target_group for target_group, is_empty in zip(owned, empty_flags) if is_empty]
+
+def parse_epoch_seconds(value):
+    # Accepts epoch seconds or an ISO 8601 timestamp
+    if not value:
+        return None
+    epoch = safe_cast(value, float)
+    if epoch is not None:
+        return epoch
+    try:
+        timestamp = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if not timestamp.tzinfo:
+        timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+    return timestamp.timestamp()
+
+class TokenBucket:
+    def __init__(self, rate_per_sec, capacity=None):
+        self.rate_per_sec = float(rate_per_sec)
+        self.capacity = float(capacity or max(1, rate_per_sec))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate_per_sec)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            time.sleep((1 - self.tokens) / self.rate_per_sec)
+
+@ext(handler=eh, op="preflight_quota_check")
+@profiled
+def preflight_quota_check(targets, protocol):
+    # Runs after get_target_group has planned the writes, and before any of them are sent
+    creating = bool(eh.ops.get("create_target_group"))
+    if creating:
+        registrations = len(targets or [])
+    else:
+        registrations = len(eh.ops.get("register_targets") or [])
+    if not creating and not registrations:
+        return
+
+    # These quotas are per load balancer, so they only bind once a listener forwards to the group
+    load_balancer_arns = [] if creating else (eh.props.get("load_balancer_arns") or [])
+    try:
+        problems, targets_by_load_balancer = check_quotas(client, creating, registrations, protocol, load_balancer_arns)
+    # Not being able to read the limits shouldn't block a deployment, the writes will report quota errors themselves
+    except ClientError as e:
+        eh.add_log("Could Not Check Quotas", {"error": str(e)})
+        return
+
+    eh.add_log("Checked Quotas", {"creating": creating, "registrations": registrations, "targets_by_load_balancer": targets_by_load_balancer, "problems": problems}, is_error=bool(problems))
+    if problems:
+        eh.perm_error(" ".join(problems), 15)
+
+def check_quotas(elbv2_client, creating, registrations, protocol, load_balancer_arns):
+    # Returns the quota problems the planned writes would run into, and the per load balancer target counts behind them
+    region = elbv2_client.meta.region_name
+    limit_name = TARGETS_LIMIT_BY_PROTOCOL.get(protocol)
+    checking_targets = bool(registrations and limit_name and load_balancer_arns)
+    if not creating and not checking_targets:
+        return [], {}
+
+    limits = cached_account_usage(region, "limits", functools.partial(read_account_limits, elbv2_client))
+    problems = []
+    if creating and "target-groups" in limits:
+        target_group_count = cached_account_usage(region, "target_group_count", functools.partial(count_target_groups, elbv2_client))
+        headroom = limits["target-groups"] - target_group_count
+        if headroom < 1:
+            problems.append(f"Creating this target group needs 1 more target group, but {target_group_count} of the {limits['target-groups']} allowed (target-groups quota) already exist. Headroom: {headroom}.")
+
+    targets_by_load_balancer = {}
+    if checking_targets and limit_name in limits:
+        for load_balancer_arn in load_balancer_arns:
+            current_targets = cached_account_usage(region, f"targets:{load_balancer_arn}", functools.partial(count_load_balancer_targets, elbv2_client, load_balancer_arn))
+            targets_by_load_balancer[load_balancer_arn] = current_targets
+            headroom = limits[limit_name] - current_targets
+            if registrations > headroom:
+                problems.append(f"Registering {registrations} targets on top of the {current_targets} already registered across the target groups of {load_balancer_arn} exceeds the {limit_name} quota of {limits[limit_name]}. Headroom: {headroom}.")
+    return problems, targets_by_load_balancer
+
+def cached_account_usage(region, key, fetch):
+    now = current_epoch_time_usec_num() // 1000000
+    region_cache = account_limits_cache.setdefault(region, {})
+    entry = region_cache.get(key)
+    if entry and now - entry["fetched_at"] < ACCOUNT_LIMITS_TTL_SEC:
+        return entry["value"]
+    value = fetch()
+    region_cache[key] = {"fetched_at": now, "value": value}
+    return value
+
+def read_account_limits(elbv2_client):
+    limits = {}
+    for page in elbv2_client.get_paginator("describe_account_limits").paginate():
+        limits.update({item.get("Name"): int(float(item.get("Max"))) for item in page.get("Limits", [])})
+    return limits
+
+def count_target_groups(elbv2_client):
+    target_group_count = 0
+    for page in elbv2_client.get_paginator("describe_target_groups").paginate(PaginationConfig={"PageSize": 400}):
+        target_group_count += len(page.get("TargetGroups", []))
+    return target_group_count
+
+def count_load_balancer_targets(elbv2_client, load_balancer_arn):
+    # A load balancer's target quota counts every registration in every target group it forwards to
+    count = 0
+    for page in elbv2_client.get_paginator("describe_target_groups").paginate(LoadBalancerArn=load_balancer_arn):
+        for target_group in page.get("TargetGroups", []):
+            response = elbv2_client.describe_target_health(TargetGroupArn=target_group.get("TargetGroupArn"))
+            count += len(response.get("TargetHealthDescriptions", []))
+    return count
+
+def adjust_cached_usage(region, key, delta):
+    # Keep the cached usage honest for the next deployment in this container instead of waiting out the TTL
+    entry = (account_limits_cache.get(region) or {}).get(key)
+    if entry:
+        entry["value"] += delta
+
+def adjust_cached_target_group_count(region, delta):
+    adjust_cached_usage(region, "target_group_count", delta)
+
+def adjust_cached_load_balancer_targets(region, load_balancer_arns, delta):
+    for load_balancer_arn in load_balancer_arns or []:
+        adjust_cached_usage(region, f"targets:{load_balancer_arn}", delta)
+
 @ext(handler=eh, op="create_target_group")
+@profiled
 def create_target_group(attributes, targets, special_attributes, default_special_attributes, region, prev_state):
 
     try:
@@ -506,6 +1187,7 @@ def create_target_group(attributes, targets, special_attributes, default_special
         target_group_arn = target_group.get("TargetGroupArn")
 
         eh.add_log("Created Target Group", target_group)
+        adjust_cached_target_group_count(client.meta.region_name, 1)
         eh.add_state({"target_group_arn": target_group.get("TargetGroupArn")})
         eh.add_props({
             "name": target_group.get("TargetGroupName"),
@@ -526,25 +1208,13 @@ def create_target_group(attributes, targets, special_attributes, default_special
         # Figure out what targets needs to be removed and added and setup those actions
         prev_targets = prev_state.get("props", {}).get("targets")
 
-        targets_comparable = []
-        if targets:
-            targets_comparable = [f"{item.get('Id')}${item.get('Port', '')}${item.get('AvailabilityZone', '')}" for item in targets]
-
-        prev_targets_comparable= []
-        if prev_targets:
-            prev_targets_comparable = [f"{item.get('Id')}${item.get('Port', '')}${item.get('AvailabilityZone', '')}" for item in prev_targets]
-
-        prev_targets_to_remove = [prev_target.split("$")[0] for prev_target in prev_targets_comparable if prev_target not in targets_comparable]
-        targets_to_add = [remove_none_attributes({ \
-            "Id": def_target.split("$")[0], \
-            "Port": safe_cast(def_target.split("$")[1], int, def_target.split("$")[1]) or None, \
-            "AvailabilityZone": def_target.split("$")[2] or None \
-            }) for def_target in targets_comparable if def_target not in prev_targets_comparable]
+        targets_to_add, prev_targets_to_remove = diff_targets(targets, prev_targets)
         
         if targets_to_add:
             eh.add_op("register_targets", targets_to_add)
         if prev_targets_to_remove:
             eh.add_op("deregister_targets", prev_targets_to_remove)
+        eh.add_op("refresh_target_health_snapshot", {"targets_changed": bool(targets_to_add or prev_targets_to_remove)})
 
         # Figure out if there are special attributes that need to be set, otherwise reset all of the special attributes that exist current on the target group to their original values
         try:
@@ -555,7 +1225,7 @@ def create_target_group(attributes, targets, special_attributes, default_special
 
             if special_attributes:
                 # You either use whatever is being passed in or the default. That's it. And you only care about parameters that are allowed to be set for the current setup.
-                update_special_attributes = {key: (special_attributes.get(key) or default_special_attributes.get(key)) for key, current_value in current_special_attributes.items() }
+                update_special_attributes = special_attributes_to_write(special_attributes, default_special_attributes, current_special_attributes)
                 eh.add_state({"update_special_attributes": update_special_attributes})
                 eh.add_op("update_target_group_special_attributes", update_special_attributes)
 
@@ -580,23 +1250,12 @@ def create_target_group(attributes, targets, special_attributes, default_special
                 if relevant_item.get("Tags"):
                     current_tags = {item.get("Key") : item.get("Value") for item in relevant_item.get("Tags")}
 
-            # If there are tags specified, figure out which ones need to be added and which ones need to be removed
-            if attributes.get("Tags"):
-
-                tags = attributes.get("Tags")
-                formatted_tags = {item.get("Key") : item.get("Value") for item in tags}
-                # Compare the current tags to the desired tags
-                if formatted_tags != current_tags:
-                    remove_tags = [k for k in current_tags.keys() if k not in formatted_tags]
-                    add_tags = {k:v for k,v in formatted_tags.items() if v != current_tags.get(k)}
-                    if remove_tags:
-                        eh.add_op("remove_tags", remove_tags)
-                    if add_tags:
-                        eh.add_op("set_tags", add_tags)
-            # If there are no tags specified, make sure to remove any straggler tags
-            else:
-                if current_tags:
-                    eh.add_op("remove_tags", list(current_tags.keys()))
+            # Figure out which tags need to be added and which ones need to be removed. No tags specified removes any stragglers.
+            remove_tags, add_tags = diff_tags(attributes.get("Tags"), current_tags)
+            if remove_tags:
+                eh.add_op("remove_tags", remove_tags)
+            if add_tags:
+                eh.add_op("set_tags", add_tags)
 
         # If the target group does not exist, some wrong has happened. Probably don't permanently fail though, try to continue.
         except client.exceptions.TargetGroupNotFoundException:
@@ -620,6 +1279,7 @@ def create_target_group(attributes, targets, special_attributes, default_special
         handle_common_errors(e, eh, "Error Creating Target Group", progress=20)
 
 @ext(handler=eh, op="remove_tags")
+@profiled
 def remove_tags():
 
     remove_tags = eh.ops.get('remove_tags')
@@ -639,6 +1299,7 @@ def remove_tags():
 
 
 @ext(handler=eh, op="set_tags")
+@profiled
 def set_tags():
 
     tags = eh.ops.get("set_tags")
@@ -665,6 +1326,7 @@ def set_tags():
         handle_common_errors(e, eh, "Error Adding Tags", progress=90)
 
 @ext(handler=eh, op="register_targets")
+@profiled
 def register_targets():
 
     targets = eh.ops.get("register_targets")
@@ -696,6 +1358,7 @@ def register_targets():
         eh.add_props({
             "targets": targets
         })
+        adjust_cached_load_balancer_targets(client.meta.region_name, eh.props.get("load_balancer_arns"), len(targets))
 
     except client.exceptions.TargetGroupNotFoundException as e:
         eh.add_log("Target Group Not Found", {"error": str(e)}, is_error=True)
@@ -714,6 +1377,7 @@ def register_targets():
         handle_common_errors(e, eh, "Error Registering Targets", progress=60)
 
 @ext(handler=eh, op="deregister_targets")
+@profiled
 def deregister_targets():
 
     targets = eh.ops.get("deregister_targets")
@@ -725,6 +1389,7 @@ def deregister_targets():
             Targets=formatted_targets
         )
         eh.add_log("Targets Deregistered", response)
+        adjust_cached_load_balancer_targets(client.meta.region_name, eh.props.get("load_balancer_arns"), -len(targets))
     except client.exceptions.TargetGroupNotFoundException as e:
         eh.add_log("Target Group Not Found", {"error": str(e)}, is_error=True)
         eh.perm_error(str(e), 60)
@@ -736,9 +1401,9 @@ def deregister_targets():
         handle_common_errors(e, eh, "Error Deregistering Targets", progress=60)
 
 @ext(handler=eh, op="update_target_group")
+@profiled
 def update_target_group(attributes):
-    attributes_to_remove = ["Name", "Protocol", "ProtocolVersion", "Port", "VpcId", "TargetType", "Tags", "IpAddressType"]
-    filtered_attributes = {attr: attributes[attr] for attr in attributes if attr not in attributes_to_remove}
+    filtered_attributes = {attr: attributes[attr] for attr in attributes if attr not in NON_MODIFIABLE_ATTRIBUTES}
     filtered_attributes["TargetGroupArn"] = eh.state["target_group_arn"]
     
     region = eh.state["region"]
@@ -776,6 +1441,7 @@ def update_target_group(attributes):
     
 
 @ext(handler=eh, op="update_target_group_special_attributes")
+@profiled
 def update_target_group_special_attributes():
 
     target_group_arn = eh.state["target_group_arn"]
@@ -801,13 +1467,14 @@ def update_target_group_special_attributes():
         handle_common_errors(e, eh, "Error Updating Target Group Special Attributes", progress=80)
 
 @ext(handler=eh, op="reset_target_group_special_attributes")
+@profiled
 def reset_target_group_special_attributes(default_special_attributes):
 
     target_group_arn = eh.state["target_group_arn"]
     # current_special_attributes = eh.state["current_special_attributes"] # Pre-calculated in the get call get pull it in here and make the change
     current_special_attributes = eh.state["current_special_attributes"]
 
-    update_attributes = {key: default_special_attributes.get(key) for key in current_special_attributes}
+    update_attributes = special_attributes_to_write(None, default_special_attributes, current_special_attributes)
     formatted_update_attributes = [{"Key": key, "Value": value} for key, value in update_attributes.items()]
                          
     try:
@@ -829,23 +1496,581 @@ def reset_target_group_special_attributes(default_special_attributes):
         
 
 
+@ext(handler=eh, op="refresh_target_health_snapshot")
+@profiled
+def refresh_target_health_snapshot(ttl_seconds, prev_state):
+    target_group_arn = eh.state["target_group_arn"]
+    now = current_epoch_time_usec_num() // 1000000
+
+    # Reuse the last snapshot while it is fresh, unless this deployment changed the targets
+    prev_snapshot = prev_state.get("props", {}).get("health_snapshot")
+    targets_changed = (eh.ops.get("refresh_target_health_snapshot") or {}).get("targets_changed")
+    if prev_snapshot and not targets_changed and \
+        prev_snapshot.get("target_group_arn") == target_group_arn and \
+        now - (prev_snapshot.get("generated_at") or 0) < ttl_seconds:
+        eh.add_log("Reusing Health Snapshot", {"generated_at": prev_snapshot.get("generated_at")})
+        eh.add_props({"health_snapshot": prev_snapshot})
+        return
+
+    # The snapshot itself is only counters, but describe_target_health is unpaginated, so its full response is in memory while we count.
+    # It only returns a zone if one was given at registration. ip targets are matched against the VPC's subnets from one read;
+    # instances without a zone are counted by (id, state) until their zone is looked up, so those grow with the number of instances.
+    target_type = eh.props.get("target_type")
+    subnet_zones = load_subnet_zones(eh.props.get("vpc_id")) if target_type == "ip" else []
+    state_counts = Counter()
+    az_counts = defaultdict(Counter)
+    unresolved_counts = Counter()
+    failure_reasons = Counter()
+    try:
+        for description in iter_target_health(target_group_arn):
+            state = description.get("TargetHealth", {}).get("State", "unknown")
+            target_id = description.get("Target", {}).get("Id")
+            availability_zone = description.get("Target", {}).get("AvailabilityZone")
+            state_counts[state] += 1
+            if state != "healthy" and description.get("TargetHealth", {}).get("Reason"):
+                failure_reasons[description["TargetHealth"]["Reason"]] += 1
+            if not availability_zone and target_type == "instance":
+                unresolved_counts[(target_id, state)] += 1
+                continue
+            if not availability_zone and subnet_zones:
+                availability_zone = zone_for_ip(target_id, subnet_zones)
+            az_counts[availability_zone or "unspecified"][state] += 1
+    except client.exceptions.TargetGroupNotFoundException:
+        eh.add_log("Target Group Not Found", {"arn": target_group_arn})
+        return
+    except ClientError as e:
+        handle_common_errors(e, eh, "Error Reading Target Health", progress=95)
+        return
+
+    zones = resolve_instance_availability_zones(list(dict.fromkeys(target_id for target_id, _ in unresolved_counts)))
+    for (target_id, state), count in unresolved_counts.items():
+        az_counts[zones.get(target_id) or "unspecified"][state] += count
+
+    snapshot = {
+        "target_group_arn": target_group_arn,
+        "generated_at": now,
+        "total": sum(state_counts.values()),
+        "counts": dict(state_counts),
+        "by_availability_zone": {az: dict(counts) for az, counts in az_counts.items()},
+        "top_failure_reasons": [{"reason": reason, "count": count} for reason, count in failure_reasons.most_common(HEALTH_SNAPSHOT_TOP_REASONS)]
+    }
+    eh.add_log("Generated Health Snapshot", {"total": snapshot["total"], "counts": snapshot["counts"]})
+    eh.add_props({"health_snapshot": snapshot})
+
+def resolve_instance_availability_zones(instance_ids):
+    zones = {}
+    try:
+        for i in range(0, len(instance_ids), AZ_LOOKUP_BATCH_SIZE):
+            # A filter rather than InstanceIds, so one terminated instance doesn't fail the whole batch
+            filters = [{"Name": "instance-id", "Values": instance_ids[i:i + AZ_LOOKUP_BATCH_SIZE]}]
+            for page in get_ec2_client().get_paginator("describe_instances").paginate(Filters=filters):
+                for reservation in page.get("Reservations", []):
+                    for instance in reservation.get("Instances", []):
+                        zones[instance.get("InstanceId")] = instance.get("Placement", {}).get("AvailabilityZone")
+    # Zones are nice to have, the snapshot is still useful without them
+    except ClientError as e:
+        eh.add_log("Could Not Resolve Target Availability Zones", {"error": str(e)})
+    return zones
+
+def load_subnet_zones(vpc_id):
+    # Returns (network, zone) for every IPv4 and IPv6 block of the VPC's subnets
+    subnet_zones = []
+    if not vpc_id:
+        return subnet_zones
+    try:
+        for page in get_ec2_client().get_paginator("describe_subnets").paginate(Filters=[{"Name": "vpc-id", "Values": [vpc_id]}]):
+            for subnet in page.get("Subnets", []):
+                cidr_blocks = [subnet.get("CidrBlock")] + [item.get("Ipv6CidrBlock") for item in subnet.get("Ipv6CidrBlockAssociationSet", [])]
+                subnet_zones.extend((ipaddress.ip_network(cidr_block), subnet.get("AvailabilityZone")) for cidr_block in cidr_blocks if cidr_block)
+    # Zones are nice to have, the snapshot is still useful without them
+    except ClientError as e:
+        eh.add_log("Could Not Resolve Target Availability Zones", {"error": str(e)})
+    return subnet_zones
+
+def zone_for_ip(ip, subnet_zones):
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+    return next((zone for network, zone in subnet_zones if address in network), None)
+
+def get_ec2_client():
+    global ec2_client
+    if ec2_client is None:
+        ec2_client = boto3.client("ec2", region_name=client.meta.region_name)
+        ec2_client.meta.events.register("provide-client-params", functools.partial(trace_call_started, ec2_client.meta.region_name))
+        ec2_client.meta.events.register("after-call", functools.partial(trace_call_finished, ec2_client.meta.region_name))
+    return ec2_client
+
+def iter_target_health(target_group_arn, elbv2_client=None):
+    # describe_target_health is not paginated today; use the paginator if botocore ever grows one
+    elbv2_client = elbv2_client or client
+    if elbv2_client.can_paginate("describe_target_health"):
+        for page in elbv2_client.get_paginator("describe_target_health").paginate(TargetGroupArn=target_group_arn):
+            yield from page.get("TargetHealthDescriptions", [])
+    else:
+        response = elbv2_client.describe_target_health(TargetGroupArn=target_group_arn)
+        yield from response.get("TargetHealthDescriptions", [])
+
+@ext(handler=eh, op="get_target_group_for_delete")
+@profiled
+def get_target_group_for_delete():
+    start_teardown_stage("describe")
+    target_group_arn = eh.state["target_group_arn"]
+
+    try:
+        load_balancer_arns, registered_targets = describe_for_teardown(client, target_group_arn)
+
+        eh.add_log("Planned Target Group Teardown", {
+            "arn": target_group_arn,
+            "load_balancer_arns": load_balancer_arns,
+            "targets_to_deregister": len(registered_targets)
+        })
+        eh.add_state({"load_balancer_arns": load_balancer_arns})
+
+        # Targets only go once nothing routes to the group anymore. If a listener never lets go,
+        # the failed delete must not leave it forwarding to an empty group.
+        if load_balancer_arns:
+            eh.add_op("wait_for_listener_detachment")
+        if registered_targets:
+            eh.add_op("deregister_all_targets", registered_targets)
+        eh.add_op("delete_target_group")
+        finish_teardown_stage("describe")
+
+    except client.exceptions.TargetGroupNotFoundException:
+        eh.add_log("Target Group Already Deleted", {"arn": target_group_arn})
+    except ClientError as e:
+        handle_common_errors(e, eh, "Error Describing Target Group for Delete", progress=20)
+
+@ext(handler=eh, op="deregister_all_targets")
+@profiled
+def deregister_all_targets():
+    start_teardown_stage("deregister")
+    target_group_arn = eh.state["target_group_arn"]
+    # On a retry only the chunks that failed last time are sent again
+    targets = eh.state.get("targets_to_deregister") or eh.ops.get("deregister_all_targets")
+    failed_targets, errors = deregister_targets_in_chunks(client, target_group_arn, targets)
+
+    if errors:
+        eh.add_state({"targets_to_deregister": failed_targets})
+        eh.add_log("Some Target Chunks Failed to Deregister", {"failed": len(failed_targets), "error": str(errors[0])}, is_error=True)
+        handle_common_errors(errors[0], eh, "Error Deregistering Targets", progress=40)
+        return
+
+    eh.add_state({"targets_to_deregister": None})
+    eh.add_log("Targets Deregistered", {"count": len(targets)})
+    finish_teardown_stage("deregister")
+
+@ext(handler=eh, op="wait_for_listener_detachment")
+@profiled
+def wait_for_listener_detachment():
+    start_teardown_stage("wait_for_listener_detachment")
+    target_group_arn = eh.state["target_group_arn"]
+    polls = eh.state.get("detachment_polls") or 0
+    backoff_step = eh.state.get("detachment_backoff_step") or 0
+    prev_load_balancer_arns = eh.state.get("load_balancer_arns") or []
+
+    try:
+        response = client.describe_target_groups(TargetGroupArns=[target_group_arn])
+        load_balancer_arns = response.get("TargetGroups")[0].get("LoadBalancerArns") or []
+    except client.exceptions.TargetGroupNotFoundException:
+        eh.add_log("Target Group Already Deleted", {"arn": target_group_arn})
+        finish_teardown_stage("wait_for_listener_detachment")
+        return
+    except ClientError as e:
+        handle_common_errors(e, eh, "Error Checking Listener Detachment", progress=60)
+        return
+
+    if not load_balancer_arns:
+        eh.add_log("Target Group Detached From Load Balancers", {"arn": target_group_arn, "polls": polls})
+        finish_teardown_stage("wait_for_listener_detachment")
+        return
+
+    if polls >= LISTENER_DETACHMENT_MAX_POLLS:
+        eh.add_log("Target Group Still Attached", {"load_balancer_arns": load_balancer_arns}, is_error=True)
+        eh.perm_error(f"Target group is still used by {', '.join(load_balancer_arns)}. Remove the listeners or rules that forward to it and try again.", 60)
+        return
+
+    callback_sec, backoff_step = next_detachment_backoff(load_balancer_arns, prev_load_balancer_arns, backoff_step)
+    eh.add_state({
+        "load_balancer_arns": load_balancer_arns,
+        "detachment_polls": polls + 1,
+        "detachment_backoff_step": backoff_step
+    })
+    eh.add_log("Waiting for Listener Detachment", {"load_balancer_arns": load_balancer_arns, "callback_sec": callback_sec})
+    eh.retry_error(f"Waiting for Listener Detachment {polls}", progress=60, callback_sec=callback_sec)
+
 @ext(handler=eh, op="delete_target_group")
+@profiled
 def delete_target_group():
+    start_teardown_stage("delete")
     target_group_arn = eh.state["target_group_arn"]
     try:
         response = client.delete_target_group(
             TargetGroupArn=target_group_arn
         )
         eh.add_log("Target Group Deleted", {"target_group_arn": target_group_arn})
+        adjust_cached_target_group_count(client.meta.region_name, -1)
+        finish_teardown_stage("delete")
+        eh.add_log("Teardown Timings (ms)", eh.state.get("teardown_timings_ms"))
+    # A listener or rule was attached after we checked. Go back to polling rather than burning generic retries.
     except client.exceptions.ResourceInUseException as e:
-        handle_common_errors(e, eh, "Error Deleting Target Group. Resource in Use.", progress=80)
+        eh.add_log("Target Group Still in Use", {"error": str(e)})
+        eh.add_op("wait_for_listener_detachment")
+        eh.retry_error("Target Group In Use", progress=80, callback_sec=LISTENER_DETACHMENT_BASE_SEC)
     except ClientError as e:
         handle_common_errors(e, eh, "Error Deleting Target Group", progress=80)
-    
 
+def describe_for_teardown(elbv2_client, target_group_arn):
+    # One describe tells us whether any load balancer still references the group
+    response = elbv2_client.describe_target_groups(TargetGroupArns=[target_group_arn])
+    load_balancer_arns = response.get("TargetGroups")[0].get("LoadBalancerArns") or []
+
+    # Targets that are already draining have been deregistered, leave them be
+    registered_targets = [remove_none_attributes({
+        "Id": item.get("Target", {}).get("Id"),
+        "Port": item.get("Target", {}).get("Port"),
+        "AvailabilityZone": item.get("Target", {}).get("AvailabilityZone")
+    }) for item in iter_target_health(target_group_arn, elbv2_client) if item.get("TargetHealth", {}).get("State") != "draining"]
+    return load_balancer_arns, registered_targets
+
+def deregister_targets_in_chunks(elbv2_client, target_group_arn, targets):
+    # Returns the targets of the chunks that failed along with the errors, so a retry only resends those
+    chunks = [targets[i:i + DEREGISTER_CHUNK_SIZE] for i in range(0, len(targets), DEREGISTER_CHUNK_SIZE)]
+
+    def deregister_chunk(chunk):
+        return elbv2_client.deregister_targets(TargetGroupArn=target_group_arn, Targets=chunk)
+
+    failed_targets = []
+    errors = []
+    with ThreadPoolExecutor(max_workers=max(1, min(TEARDOWN_MAX_WORKERS, len(chunks)))) as executor:
+        futures = {executor.submit(deregister_chunk, chunk): chunk for chunk in chunks}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            # The group is gone already, nothing left to deregister from
+            except elbv2_client.exceptions.TargetGroupNotFoundException:
+                pass
+            except ClientError as e:
+                failed_targets.extend(futures[future])
+                errors.append(e)
+    return failed_targets, errors
+
+def next_detachment_backoff(load_balancer_arns, prev_load_balancer_arns, backoff_step):
+    # Back off exponentially while nothing changes, but drop back to the shortest
+    # wait as soon as a load balancer lets go, since the rest usually follow quickly.
+    if len(load_balancer_arns) < len(prev_load_balancer_arns):
+        backoff_step = 0
+    return min(LISTENER_DETACHMENT_BASE_SEC * (2 ** backoff_step), LISTENER_DETACHMENT_MAX_SEC), backoff_step + 1
+
+@ext(handler=eh, op="deploy_regions")
+@profiled
+def deploy_regions(attributes, targets, special_attributes, default_special_attributes, prev_state):
+    regions = eh.ops.get("deploy_regions")
+    prev_regions = prev_regions_from_props(prev_state.get("props", {}))
+    # Regions that already succeeded are kept as they are when we retry the ones that failed
+    region_results = eh.state.get("region_results") or {}
+    pending_regions = [region for region in regions if region not in region_results]
+    # Filled in by the workers as soon as a create returns
+    created_target_groups = eh.state.get("region_created_target_groups") or {}
+
+    errors = {}
+    permanent_errors = {}
+    with ThreadPoolExecutor(max_workers=len(pending_regions) or 1) as executor:
+        futures = {executor.submit(
+            deploy_target_group_in_region,
+            region,
+            {**attributes, **remove_none_attributes({"VpcId": regions[region].get("vpc_id")})},
+            targets,
+            special_attributes,
+            default_special_attributes,
+            prev_regions.get(region) or {},
+            created_target_groups
+        ): region for region in pending_regions}
+        for future in as_completed(futures):
+            region = futures[future]
+            try:
+                region_results[region] = future.result()
+            # Retrying won't free up quota or fix the definition
+            except (RegionQuotaError, botocore.exceptions.ParamValidationError) as e:
+                permanent_errors[region] = str(e)
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") in PERMANENT_REGION_ERROR_CODES:
+                    permanent_errors[region] = str(e)
+                else:
+                    errors[region] = str(e)
+            # Anything else is retried too, and must not skip the bookkeeping below for the regions that did create a group
+            except Exception as e:
+                errors[region] = str(e)
+
+    eh.add_state({"region_results": region_results, "region_created_target_groups": created_target_groups})
+    # Regions that haven't finished keep their last known group in props, so a delete can still find it if they never do
+    unfinished_regions = {region: prev_regions[region] for region in regions if region in prev_regions}
+    eh.add_props({"name": attributes.get("Name"), "regions": {**unfinished_regions, **created_target_groups, **region_results}})
+    for region, region_props in region_results.items():
+        eh.add_links({f"Target Group ({region})": gen_target_group_link(region, region_props.get("arn"))})
+    eh.add_log("Deployed Target Group to Regions", {"succeeded": sorted(region_results), "failed": errors, "failed_permanently": permanent_errors})
+
+    # Those regions fail the deployment once the others are done
+    if permanent_errors:
+        eh.add_log("Region Deployment Failed", permanent_errors, is_error=True)
+        eh.perm_error(" ".join(f"{region}: {error}" for region, error in permanent_errors.items()), 15)
+    elif errors:
+        eh.add_log("Region Deployment Errors", errors, is_error=True)
+        eh.retry_error("Region Deployment Errors", progress=50)
+
+class RegionQuotaError(Exception):
+    """Raised by deploy_target_group_in_region when the region's quotas can't take the planned writes."""
+
+def prev_regions_from_props(prev_props):
+    # A component deployed to a single region before it listed regions only has a top level arn
+    if prev_props.get("regions"):
+        return prev_props["regions"]
+    if prev_props.get("arn"):
+        return {prev_props["arn"].split(":")[3]: prev_props}
+    return {}
+
+def changed_non_editable_fields(prev_props, definition_values, regions=None):
+    # With regions, every region already deployed is held to its own entry, vpc_id included. That covers the home
+    # region's group when a single region component moves to regions. Regions dropped from the list are deleted instead.
+    if not regions:
+        return [field for field, value in definition_values.items() if prev_props.get(field) and prev_props.get(field) != value]
+    changed_fields = []
+    for region, region_props in prev_regions_from_props(prev_props).items():
+        if region not in regions:
+            continue
+        region_values = {**definition_values, "vpc_id": regions[region].get("vpc_id") or definition_values.get("vpc_id")}
+        changed_fields.extend(f"{field} ({region})" for field, value in region_values.items() if region_props.get(field) and region_props.get(field) != value)
+    return changed_fields
+
+def deploy_target_group_in_region(region, attributes, targets, special_attributes, default_special_attributes, prev_region_props, created_target_groups):
+    # The same get/create/update plan as the single region ops, run straight through against one region's client
+    regional_client = get_regional_client(region)
+    try:
+        response = regional_client.describe_target_groups(Names=[attributes.get("Name")])
+        existing_target_group = response.get("TargetGroups")[0]
+    except regional_client.exceptions.TargetGroupNotFoundException:
+        existing_target_group = None
+        prev_region_props = {}
+    targets_to_add, prev_targets_to_remove = diff_targets(targets, prev_region_props.get("targets"))
+
+    # Each region has its own quotas, checked against the writes planned for it before any are sent
+    try:
+        problems, _ = check_quotas(
+            regional_client,
+            not existing_target_group,
+            len(targets_to_add),
+            attributes.get("Protocol"),
+            (existing_target_group or {}).get("LoadBalancerArns") or []
+        )
+    # Not being able to read the limits shouldn't block a deployment, the writes will report quota errors themselves
+    except ClientError:
+        problems = []
+    if problems:
+        raise RegionQuotaError(" ".join(problems))
+
+    if existing_target_group:
+        response = regional_client.modify_target_group(
+            TargetGroupArn=existing_target_group.get("TargetGroupArn"),
+            **{attr: attributes[attr] for attr in attributes if attr not in NON_MODIFIABLE_ATTRIBUTES}
+        )
+    else:
+        response = regional_client.create_target_group(**attributes)
+        adjust_cached_target_group_count(region, 1)
+    target_group = response.get("TargetGroups")[0]
+    target_group_arn = target_group.get("TargetGroupArn")
+    if not existing_target_group:
+        # Recorded before anything else can fail, so a later delete finds the group even if this region never finishes
+        created_target_groups[region] = {"name": target_group.get("TargetGroupName"), "arn": target_group_arn}
+
+    if prev_targets_to_remove:
+        regional_client.deregister_targets(TargetGroupArn=target_group_arn, Targets=[{"Id": item} for item in prev_targets_to_remove])
+        adjust_cached_load_balancer_targets(region, target_group.get("LoadBalancerArns"), -len(prev_targets_to_remove))
+    if targets_to_add:
+        regional_client.register_targets(TargetGroupArn=target_group_arn, Targets=targets_to_add)
+        adjust_cached_load_balancer_targets(region, target_group.get("LoadBalancerArns"), len(targets_to_add))
+
+    response = regional_client.describe_target_group_attributes(TargetGroupArn=target_group_arn)
+    current_special_attributes = {item.get("Key"): item.get("Value") for item in response["Attributes"]}
+    update_attributes = special_attributes_to_write(special_attributes, default_special_attributes, current_special_attributes)
+    if update_attributes:
+        regional_client.modify_target_group_attributes(
+            TargetGroupArn=target_group_arn,
+            Attributes=[{"Key": key, "Value": value} for key, value in update_attributes.items()]
+        )
+
+    response = regional_client.describe_tags(ResourceArns=[target_group_arn])
+    current_tags = {tag.get("Key"): tag.get("Value") for item in response.get("TagDescriptions") if item.get("ResourceArn") == target_group_arn for tag in item.get("Tags", [])}
+    remove_tags, add_tags = diff_tags(attributes.get("Tags"), current_tags)
+    if remove_tags:
+        regional_client.remove_tags(ResourceArns=[target_group_arn], TagKeys=remove_tags)
+    if add_tags:
+        regional_client.add_tags(ResourceArns=[target_group_arn], Tags=[{"Key": key, "Value": value} for key, value in add_tags.items()])
+
+    return {
+        "name": target_group.get("TargetGroupName"),
+        "arn": target_group_arn,
+        "vpc_id": target_group.get("VpcId"),
+        "port": target_group.get("Port"),
+        "load_balancer_arns": target_group.get("LoadBalancerArns"),
+        "protocol": target_group.get("Protocol"),
+        "protocol_version": target_group.get("ProtocolVersion"),
+        "target_type": target_group.get("TargetType"),
+        "ip_address_type": target_group.get("IpAddressType"),
+        "targets": targets
+    }
+
+@ext(handler=eh, op="delete_regions")
+@profiled
+def delete_regions():
+    region_arns = eh.ops.get("delete_regions")
+    # Each region moves through its own describe -> wait for detachment -> deregister -> delete stages
+    teardowns = eh.state.get("region_teardowns") or {}
+    pending_regions = [region for region in region_arns if (teardowns.get(region) or {}).get("stage") not in ("done", "failed")]
+
+    with ThreadPoolExecutor(max_workers=len(pending_regions) or 1) as executor:
+        futures = {executor.submit(teardown_step_in_region, region, region_arns[region], teardowns.get(region) or {"stage": "describe"}): region for region in pending_regions}
+        for future in as_completed(futures):
+            teardowns[futures[future]] = future.result()
+    eh.add_state({"region_teardowns": teardowns})
+    # When deploy_regions dropped these regions, keep the ones not deleted yet in props so the next deploy tries again
+    if eh.props.get("regions") is not None:
+        deleted_regions = [region for region, teardown in teardowns.items() if teardown.get("stage") == "done"]
+        eh.add_props({"regions": {
+            **{region: {"arn": region_arns[region]} for region in teardowns if region not in deleted_regions},
+            **{region: region_props for region, region_props in eh.props["regions"].items() if region not in deleted_regions}
+        }})
+
+    waiting = {region: teardown for region, teardown in teardowns.items() if teardown.get("callback_sec")}
+    errors = {region: teardown.get("error") for region, teardown in teardowns.items() if teardown.get("error") and teardown.get("stage") != "failed"}
+    failed = {region: teardown.get("error") for region, teardown in teardowns.items() if teardown.get("stage") == "failed"}
+    eh.add_log("Target Group Teardown by Region", {region: {k: v for k, v in teardown.items() if k != "targets"} for region, teardown in teardowns.items()})
+
+    if errors:
+        eh.add_log("Region Delete Errors", errors, is_error=True)
+        eh.retry_error("Region Delete Errors", progress=80)
+    elif waiting:
+        total_polls = sum(teardown.get("polls", 0) for teardown in teardowns.values())
+        eh.retry_error(f"Waiting for Listener Detachment in Regions {total_polls}", progress=60, callback_sec=min(teardown["callback_sec"] for teardown in waiting.values()))
+    elif failed:
+        eh.add_log("Region Teardown Failed", failed, is_error=True)
+        eh.perm_error(" ".join(f"{region}: {error}" for region, error in failed.items()), 80)
+
+def teardown_step_in_region(region, target_group_arn, teardown):
+    # The same stages as the single region delete ops, advanced as far as they can go without waiting.
+    # Returns the new teardown state; callback_sec is set when the region is waiting on a listener.
+    regional_client = get_regional_client(region)
+    teardown = {k: v for k, v in teardown.items() if k not in ("callback_sec", "error")}
+    teardown.setdefault("started_usec", current_epoch_time_usec_num())
+    try:
+        if teardown["stage"] == "describe":
+            load_balancer_arns, registered_targets = describe_for_teardown(regional_client, target_group_arn)
+            teardown.update({"stage": "wait", "load_balancer_arns": load_balancer_arns, "targets": registered_targets, "polls": 0, "backoff_step": 0})
+        elif teardown["stage"] == "wait":
+            response = regional_client.describe_target_groups(TargetGroupArns=[target_group_arn])
+            teardown["previous_load_balancer_arns"] = teardown.get("load_balancer_arns") or []
+            teardown["load_balancer_arns"] = response.get("TargetGroups")[0].get("LoadBalancerArns") or []
+
+        if teardown["stage"] == "wait":
+            load_balancer_arns = teardown["load_balancer_arns"]
+            if load_balancer_arns:
+                if teardown["polls"] >= LISTENER_DETACHMENT_MAX_POLLS:
+                    teardown.update({"stage": "failed", "error": f"Target group is still used by {', '.join(load_balancer_arns)}. Remove the listeners or rules that forward to it and try again."})
+                    return teardown
+                callback_sec, backoff_step = next_detachment_backoff(load_balancer_arns, teardown.pop("previous_load_balancer_arns", []), teardown["backoff_step"])
+                teardown.update({"polls": teardown["polls"] + 1, "backoff_step": backoff_step, "callback_sec": callback_sec})
+                return teardown
+            teardown["stage"] = "deregister"
+
+        if teardown["stage"] == "deregister":
+            failed_targets, errors = deregister_targets_in_chunks(regional_client, target_group_arn, teardown.get("targets") or [])
+            if errors:
+                teardown.update({"targets": failed_targets, "error": str(errors[0])})
+                return teardown
+            teardown.update({"stage": "delete", "targets": []})
+
+        if teardown["stage"] == "delete":
+            try:
+                regional_client.delete_target_group(TargetGroupArn=target_group_arn)
+            # A listener or rule was attached after we checked, go back to polling
+            except regional_client.exceptions.ResourceInUseException:
+                teardown.update({"stage": "wait", "callback_sec": LISTENER_DETACHMENT_BASE_SEC})
+                return teardown
+            adjust_cached_target_group_count(region, -1)
+            teardown["stage"] = "done"
+
+    except regional_client.exceptions.TargetGroupNotFoundException:
+        teardown["stage"] = "done"
+    except (ClientError, botocore.exceptions.BotoCoreError) as e:
+        teardown["error"] = str(e)
+        return teardown
+
+    teardown["duration_ms"] = round((current_epoch_time_usec_num() - teardown["started_usec"]) / 1000)
+    return teardown
+
+def get_regional_client(region):
+    # boto3 client creation is not thread safe, so the pool is filled under a lock
+    with regional_clients_lock:
+        if region not in regional_clients:
+            regional_client = boto3.client("elbv2", region_name=region)
+            regional_client.meta.events.register("provide-client-params", functools.partial(trace_call_started, region))
+            regional_client.meta.events.register("after-call", functools.partial(trace_call_finished, region))
+            regional_client.meta.events.register("provide-client-params", functools.partial(track_describe_cache_write, region))
+            regional_client.meta.events.register("after-call", functools.partial(update_describe_cache, region))
+            regional_clients[region] = regional_client
+        return regional_clients[region]
+
+def start_teardown_stage(stage):
+    # Stages can span several retries, so the start time lives in state
+    started = eh.state.get("teardown_started_usec") or {}
+    if stage not in started:
+        started[stage] = current_epoch_time_usec_num()
+        eh.add_state({"teardown_started_usec": started})
+
+def finish_teardown_stage(stage):
+    started = eh.state.get("teardown_started_usec") or {}
+    timings = eh.state.get("teardown_timings_ms") or {}
+    if stage in started:
+        timings[stage] = round((current_epoch_time_usec_num() - started[stage]) / 1000)
+        eh.add_state({"teardown_timings_ms": timings})
 
 
 def gen_target_group_link(region, target_group_arn):
     return f"https://{region}.console.aws.amazon.com/ec2/home?region={region}#TargetGroup:targetGroupArn={target_group_arn}"
 
+def diff_targets(targets, prev_targets):
+    # Targets are compared as "id$port$az" strings. Removals are returned as bare ids, which is what deregister_targets takes.
+    targets_comparable = []
+    if targets:
+        targets_comparable = [f"{item.get('Id')}${item.get('Port', '')}${item.get('AvailabilityZone', '')}" for item in targets]
+
+    prev_targets_comparable= []
+    if prev_targets:
+        prev_targets_comparable = [f"{item.get('Id')}${item.get('Port', '')}${item.get('AvailabilityZone', '')}" for item in prev_targets]
+
+    prev_targets_to_remove = [prev_target.split("$")[0] for prev_target in prev_targets_comparable if prev_target not in targets_comparable]
+    targets_to_add = [remove_none_attributes({ \
+        "Id": def_target.split("$")[0], \
+        "Port": safe_cast(def_target.split("$")[1], int, def_target.split("$")[1]) or None, \
+        "AvailabilityZone": def_target.split("$")[2] or None \
+        }) for def_target in targets_comparable if def_target not in prev_targets_comparable]
+    return targets_to_add, prev_targets_to_remove
+
+def diff_tags(tags, current_tags):
+    # tags is in the [{"Key": key, "Value": value}, ...] format, current_tags is a plain dict
+    if not tags:
+        return list(current_tags.keys()), {}
+    formatted_tags = {item.get("Key") : item.get("Value") for item in tags}
+    remove_tags = [k for k in current_tags.keys() if k not in formatted_tags]
+    add_tags = {k:v for k,v in formatted_tags.items() if v != current_tags.get(k)}
+    return remove_tags, add_tags
+
+def special_attributes_to_write(special_attributes, default_special_attributes, current_special_attributes):
+    # The single region ops and deploy_target_group_in_region all write this full set.
+    # You either use whatever is being passed in or the default, and only for the attributes the current setup allows.
+    # Keys with neither (e.g. waf.fail_open.enabled) are left alone, since a None value fails parameter validation.
+    special_attributes = special_attributes or {}
+    update_attributes = {key: (special_attributes.get(key) or default_special_attributes.get(key)) for key in current_special_attributes}
+    return {key: value for key, value in update_attributes.items() if value is not None}
+
 
@@ -0,0 +1,133 @@
+"""
+lambda_function imports extutil, which CloudKommand provides as a Lambda layer and is not on PyPI.
+When it isn't installed, a minimal stand-in with the same interface is registered before the tests import lambda_function.
+
+Run the tests from the repository root with:
+    python -m pytest target_group
+"""
+import functools
+import os
+import random
+import string
+import sys
+import time
+import types
+
+RETRYABLE_ERROR_CODES = ("Throttling", "ThrottlingException", "RequestLimitExceeded", "InternalFailure", "ServiceUnavailable")
+
+
+def remove_none_attributes(payload):
+    return {k: v for k, v in payload.items() if v is not None}
+
+
+def account_context(context):
+    return {"region": os.environ.get("AWS_DEFAULT_REGION", "us-east-1"), "number": "000000000000"}
+
+
+def current_epoch_time_usec_num():
+    return int(time.time() * 1000000)
+
+
+def component_safe_name(project_code, repo_id, component_name, no_underscores=False, no_uppercase=False, max_chars=None):
+    name = f"{project_code}-{repo_id}-{component_name}"
+    if no_underscores:
+        name = name.replace("_", "-")
+    if no_uppercase:
+        name = name.lower()
+    return name[:max_chars] if max_chars else name
+
+
+def lambda_env(key):
+    return os.environ.get(key)
+
+
+def random_id(length=8):
+    return "".join(random.choice(string.ascii_lowercase + string.digits) for _ in range(length))
+
+
+def handle_common_errors(error, eh, message, progress=0, perm_errors=None):
+    code = error.response.get("Error", {}).get("Code")
+    eh.add_log(message, {"error": str(error)}, is_error=True)
+    if code in (perm_errors or []) or code not in RETRYABLE_ERROR_CODES:
+        eh.perm_error(str(error), progress)
+    else:
+        eh.retry_error(str(error), progress)
+
+
+class ExtensionHandler:
+
+    def __init__(self):
+        self.refresh()
+
+    def refresh(self):
+        self.ops = {}
+        self.props = {}
+        self.links = {}
+        self.state = {}
+        self.logs = []
+        self.retry = None
+        self.perm = None
+        self.status = None
+
+    def capture_event(self, event):
+        self.refresh()
+        pass_back_data = event.get("pass_back_data") or {}
+        self.ops = dict(pass_back_data.get("ops") or {})
+        self.props = dict(pass_back_data.get("props") or {})
+        self.links = dict(pass_back_data.get("links") or {})
+        self.state = dict(pass_back_data.get("state") or {})
+
+    def add_op(self, op, value=True):
+        self.ops[op] = value
+
+    def complete_op(self, op):
+        self.ops.pop(op, None)
+
+    def add_props(self, props):
+        self.props.update(props)
+
+    def add_links(self, links):
+        self.links.update(links)
+
+    def add_state(self, state):
+        self.state.update(state)
+
+    def add_log(self, title, details=None, is_error=False):
+        self.logs.append({"title": title, "details": details, "is_error": is_error})
+
+    def retry_error(self, error_id, progress=0, callback_sec=0):
+        self.retry = {"error_id": error_id, "progress": progress, "callback_sec": callback_sec}
+
+    def perm_error(self, message, progress=0):
+        self.perm = {"message": message, "progress": progress}
+
+    def declare_return(self, status_code, progress, error_code=None):
+        self.status = {"status_code": status_code, "progress": progress, "error_code": error_code}
+
+    def finish(self):
+        return {"ops": self.ops, "props": self.props, "links": self.links, "state": self.state, "retry": self.retry, "error": self.perm, "logs": self.logs}
+
+
+def ext(f=None, *, handler=None, op=None, complete_op=True):
+    # Runs the op only when it is queued and nothing has asked for a retry or failed, and completes it unless one did
+    if f is None:
+        return functools.partial(ext, handler=handler, op=op, complete_op=complete_op)
+
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        if op not in handler.ops or handler.retry or handler.perm:
+            return None
+        result = f(*args, **kwargs)
+        if complete_op and not (handler.retry or handler.perm):
+            handler.complete_op(op)
+        return result
+    return wrapper
+
+
+try:
+    import extutil  # noqa: F401
+except ImportError:
+    sys.modules["extutil"] = types.ModuleType("extutil")
+    for name in ["remove_none_attributes", "account_context", "current_epoch_time_usec_num", "component_safe_name",
+                 "lambda_env", "random_id", "handle_common_errors", "ExtensionHandler", "ext"]:
+        setattr(sys.modules["extutil"], name, globals()[name])
@@ -0,0 +1,47 @@
+import os
+import sys
+import unittest
+
+from unittest import mock
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lambda_function
+
+
+class SubnetZonesTest(unittest.TestCase):
+
+    def setUp(self):
+        ec2_client = mock.Mock()
+        ec2_client.get_paginator.return_value.paginate.return_value = [{"Subnets": [
+            {"CidrBlock": "10.0.0.0/24", "AvailabilityZone": "us-east-1a", "Ipv6CidrBlockAssociationSet": [{"Ipv6CidrBlock": "2600:1f18::/64"}]},
+            {"CidrBlock": "10.0.1.0/24", "AvailabilityZone": "us-east-1b"}
+        ]}]
+        patcher = mock.patch.object(lambda_function, "get_ec2_client", return_value=ec2_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.ec2_client = ec2_client
+
+    def test_reads_the_vpc_subnets_once(self):
+        lambda_function.load_subnet_zones("vpc-1")
+        self.ec2_client.get_paginator.return_value.paginate.assert_called_once_with(Filters=[{"Name": "vpc-id", "Values": ["vpc-1"]}])
+
+    def test_matches_addresses_to_their_subnet_zone(self):
+        subnet_zones = lambda_function.load_subnet_zones("vpc-1")
+        self.assertEqual(lambda_function.zone_for_ip("10.0.0.12", subnet_zones), "us-east-1a")
+        self.assertEqual(lambda_function.zone_for_ip("10.0.1.200", subnet_zones), "us-east-1b")
+        self.assertEqual(lambda_function.zone_for_ip("2600:1f18::5", subnet_zones), "us-east-1a")
+
+    def test_addresses_outside_the_vpc_have_no_zone(self):
+        subnet_zones = lambda_function.load_subnet_zones("vpc-1")
+        self.assertIsNone(lambda_function.zone_for_ip("192.168.0.1", subnet_zones))
+        self.assertIsNone(lambda_function.zone_for_ip("not-an-ip", subnet_zones))
+
+    def test_no_vpc_means_no_lookup(self):
+        self.assertEqual(lambda_function.load_subnet_zones(None), [])
+        self.ec2_client.get_paginator.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
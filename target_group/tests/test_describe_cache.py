@@ -0,0 +1,94 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lambda_function
+
+REGION = "us-east-1"
+ARN = "arn:aws:elasticloadbalancing:us-east-1:000000000000:targetgroup/web/0123456789abcdef"
+
+
+class DescribeCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        for patcher in [
+            mock.patch.object(lambda_function, "DESCRIBE_CACHE_DIR", cache_dir),
+            mock.patch.object(lambda_function, "describe_cache_ttl_seconds", 60)
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.describe_client = mock.Mock()
+        self.describe_client.meta.region_name = REGION
+        self.describe_client.describe_target_group_attributes.return_value = {"Attributes": [{"Key": "slow_start.duration_seconds", "Value": "0"}]}
+
+    def describe(self):
+        return lambda_function.cached_describe(self.describe_client, "describe_target_group_attributes", "web", TargetGroupArn=ARN)
+
+    def write(self, operation, parsed):
+        context = {}
+        lambda_function.track_describe_cache_write(REGION, {"TargetGroupArn": ARN}, SimpleNamespace(name=operation), context)
+        lambda_function.update_describe_cache(REGION, None, parsed, SimpleNamespace(name=operation), context)
+
+    def test_second_read_is_served_from_the_cache(self):
+        self.assertEqual(self.describe(), self.describe())
+        self.assertEqual(self.describe_client.describe_target_group_attributes.call_count, 1)
+
+    def test_expired_entries_are_read_again(self):
+        self.describe()
+        with mock.patch.object(lambda_function, "describe_cache_ttl_seconds", 0):
+            self.describe()
+        self.assertEqual(self.describe_client.describe_target_group_attributes.call_count, 2)
+
+    def test_attribute_change_writes_through(self):
+        self.describe()
+        self.write("ModifyTargetGroupAttributes", {"Attributes": [{"Key": "slow_start.duration_seconds", "Value": "30"}]})
+        self.assertEqual(self.describe()["Attributes"], [{"Key": "slow_start.duration_seconds", "Value": "30"}])
+        self.assertEqual(self.describe_client.describe_target_group_attributes.call_count, 1)
+
+    def test_failed_attribute_change_drops_the_entry(self):
+        self.describe()
+        self.write("ModifyTargetGroupAttributes", {"Error": {"Code": "Throttling"}})
+        self.describe()
+        self.assertEqual(self.describe_client.describe_target_group_attributes.call_count, 2)
+
+    def test_delete_drops_the_entry(self):
+        self.describe()
+        self.write("DeleteTargetGroup", {})
+        self.describe()
+        self.assertEqual(self.describe_client.describe_target_group_attributes.call_count, 2)
+
+    def test_other_writes_keep_the_entry(self):
+        self.describe()
+        for operation in ["ModifyTargetGroup", "RegisterTargets", "AddTags"]:
+            self.write(operation, {})
+        self.describe()
+        self.assertEqual(self.describe_client.describe_target_group_attributes.call_count, 1)
+
+    def test_writes_with_the_cache_off_still_drop_cached_entries(self):
+        self.describe()
+        with mock.patch.object(lambda_function, "describe_cache_ttl_seconds", 0):
+            self.write("ModifyTargetGroupAttributes", {"Attributes": [{"Key": "slow_start.duration_seconds", "Value": "30"}]})
+        self.describe()
+        self.assertEqual(self.describe_client.describe_target_group_attributes.call_count, 2)
+
+        with mock.patch.object(lambda_function, "describe_cache_ttl_seconds", 0):
+            self.write("DeleteTargetGroup", {})
+        self.assertFalse(os.path.exists(lambda_function.describe_cache_dir(REGION, "web")))
+
+    def test_hooks_do_nothing_for_groups_that_were_never_cached(self):
+        context = {}
+        lambda_function.track_describe_cache_write(REGION, {"TargetGroupArn": ARN}, SimpleNamespace(name="ModifyTargetGroupAttributes"), context)
+        self.assertEqual(context, {})
+
+if __name__ == "__main__":
+    unittest.main()
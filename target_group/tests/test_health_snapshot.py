@@ -0,0 +1,137 @@
+import ipaddress
+import os
+import sys
+import unittest
+
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lambda_function
+
+NOW = 1700000000
+ARN = "arn:aws:elasticloadbalancing:us-east-1:000000000000:targetgroup/web/0123456789abcdef"
+SUBNET_ZONES = [(ipaddress.ip_network("10.0.0.0/24"), "us-east-1a"), (ipaddress.ip_network("10.0.1.0/24"), "us-east-1b")]
+
+
+def description(target_id, state, availability_zone=None, reason=None):
+    return {
+        "Target": lambda_function.remove_none_attributes({"Id": target_id, "Port": 80, "AvailabilityZone": availability_zone}),
+        "TargetHealth": lambda_function.remove_none_attributes({"State": state, "Reason": reason})
+    }
+
+
+class RefreshTargetHealthSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = mock.Mock()
+        self.client.exceptions = SimpleNamespace(TargetGroupNotFoundException=type("TargetGroupNotFoundException", (Exception,), {}))
+        self.client.can_paginate.return_value = False
+        self.client.describe_target_health.return_value = {"TargetHealthDescriptions": []}
+        self.load_subnet_zones = mock.Mock(return_value=SUBNET_ZONES)
+        self.resolve_instance_availability_zones = mock.Mock(return_value={})
+        for patcher in [
+            mock.patch.object(lambda_function, "client", self.client),
+            mock.patch.object(lambda_function, "load_subnet_zones", self.load_subnet_zones),
+            mock.patch.object(lambda_function, "resolve_instance_availability_zones", self.resolve_instance_availability_zones),
+            mock.patch.object(lambda_function, "current_epoch_time_usec_num", return_value=NOW * 1000000)
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def refresh(self, descriptions=(), target_type="ip", targets_changed=False, prev_snapshot=None, ttl_seconds=60):
+        self.client.describe_target_health.return_value = {"TargetHealthDescriptions": list(descriptions)}
+        lambda_function.eh.capture_event({"op": "upsert", "prev_state": {}, "component_def": {}})
+        lambda_function.eh.add_op("refresh_target_health_snapshot", {"targets_changed": targets_changed})
+        lambda_function.eh.add_state({"target_group_arn": ARN})
+        lambda_function.eh.add_props({"target_type": target_type, "vpc_id": "vpc-1"})
+        prev_state = {"props": {"health_snapshot": prev_snapshot}} if prev_snapshot else {}
+        lambda_function.refresh_target_health_snapshot(ttl_seconds, prev_state)
+        return lambda_function.eh.props.get("health_snapshot")
+
+    def test_counts_targets_by_state_and_zone(self):
+        snapshot = self.refresh([
+            description("10.0.0.1", "healthy"),
+            description("10.0.0.2", "unhealthy", reason="Target.Timeout"),
+            description("10.0.1.1", "healthy"),
+            description("10.0.9.1", "initial", availability_zone="all"),
+            description("192.168.0.1", "healthy")
+        ])
+        self.load_subnet_zones.assert_called_once_with("vpc-1")
+        self.assertEqual(snapshot["target_group_arn"], ARN)
+        self.assertEqual(snapshot["generated_at"], NOW)
+        self.assertEqual(snapshot["total"], 5)
+        self.assertEqual(snapshot["counts"], {"healthy": 3, "unhealthy": 1, "initial": 1})
+        self.assertEqual(snapshot["by_availability_zone"], {
+            "us-east-1a": {"healthy": 1, "unhealthy": 1},
+            "us-east-1b": {"healthy": 1},
+            "all": {"initial": 1},
+            "unspecified": {"healthy": 1}
+        })
+
+    def test_instance_zones_are_looked_up_once_per_instance(self):
+        self.resolve_instance_availability_zones.return_value = {"i-1": "us-east-1a"}
+        snapshot = self.refresh([
+            description("i-1", "healthy"),
+            description("i-1", "unhealthy", reason="Target.FailedHealthChecks"),
+            description("i-2", "healthy"),
+            description("i-3", "draining", availability_zone="us-east-1b")
+        ], target_type="instance")
+        self.load_subnet_zones.assert_not_called()
+        self.resolve_instance_availability_zones.assert_called_once_with(["i-1", "i-2"])
+        self.assertEqual(snapshot["by_availability_zone"], {
+            "us-east-1a": {"healthy": 1, "unhealthy": 1},
+            "us-east-1b": {"draining": 1},
+            "unspecified": {"healthy": 1}
+        })
+        self.assertEqual(snapshot["top_failure_reasons"], [{"reason": "Target.FailedHealthChecks", "count": 1}])
+
+    def test_top_failure_reasons_are_the_most_common_unhealthy_ones(self):
+        reasons = {"Target.Timeout": 3, "Target.FailedHealthChecks": 5, "Target.ResponseCodeMismatch": 1}
+        extra_reasons = [f"Reason{i}" for i in range(lambda_function.HEALTH_SNAPSHOT_TOP_REASONS)]
+        descriptions = [description("10.0.0.1", "unhealthy", reason=reason) for reason, count in reasons.items() for _ in range(count)] + \
+            [description("10.0.0.1", "unhealthy", reason=reason) for reason in extra_reasons] + \
+            [description("10.0.0.1", "healthy", reason="Elb.RegistrationInProgress")] * 10
+        snapshot = self.refresh(descriptions)
+        self.assertEqual(len(snapshot["top_failure_reasons"]), lambda_function.HEALTH_SNAPSHOT_TOP_REASONS)
+        self.assertEqual(snapshot["top_failure_reasons"][:3], [
+            {"reason": "Target.FailedHealthChecks", "count": 5},
+            {"reason": "Target.Timeout", "count": 3},
+            {"reason": "Target.ResponseCodeMismatch", "count": 1}
+        ])
+
+    def test_a_fresh_snapshot_is_reused(self):
+        prev_snapshot = {"target_group_arn": ARN, "generated_at": NOW - 30, "total": 0}
+        self.assertIs(self.refresh(prev_snapshot=prev_snapshot), prev_snapshot)
+        self.client.describe_target_health.assert_not_called()
+
+    def test_the_snapshot_is_read_again_when_it_cannot_be_reused(self):
+        fresh = {"target_group_arn": ARN, "generated_at": NOW - 30, "total": 0}
+        for prev_snapshot, targets_changed in [
+            (fresh, True),
+            ({**fresh, "generated_at": NOW - 60}, False),
+            ({**fresh, "target_group_arn": ARN.replace("web", "api")}, False)
+        ]:
+            self.client.describe_target_health.reset_mock()
+            snapshot = self.refresh([description("10.0.0.1", "healthy")], targets_changed=targets_changed, prev_snapshot=prev_snapshot)
+            self.assertEqual((snapshot["generated_at"], snapshot["total"]), (NOW, 1))
+            self.client.describe_target_health.assert_called_once_with(TargetGroupArn=ARN)
+
+    def test_a_missing_target_group_publishes_no_snapshot(self):
+        self.client.describe_target_health.side_effect = self.client.exceptions.TargetGroupNotFoundException()
+        with mock.patch.object(lambda_function, "handle_common_errors") as handle_common_errors:
+            self.assertIsNone(self.refresh())
+        handle_common_errors.assert_not_called()
+
+    def test_client_errors_go_to_the_common_handler(self):
+        error = lambda_function.ClientError({"Error": {"Code": "Throttling", "Message": "Throttling"}}, "DescribeTargetHealth")
+        self.client.describe_target_health.side_effect = error
+        with mock.patch.object(lambda_function, "handle_common_errors") as handle_common_errors:
+            self.assertIsNone(self.refresh())
+        handle_common_errors.assert_called_once_with(error, lambda_function.eh, "Error Reading Target Health", progress=95)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,176 @@
+import os
+import sys
+import unittest
+
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lambda_function
+
+
+def arn(name):
+    return f"arn:aws:elasticloadbalancing:us-east-1:000000000000:targetgroup/{name}/0123456789abcdef"
+
+
+def target_group(name):
+    return {
+        "TargetGroupName": name,
+        "TargetGroupArn": arn(name),
+        "VpcId": "vpc-1",
+        "Port": 80,
+        "Protocol": "HTTP",
+        "ProtocolVersion": "HTTP1",
+        "TargetType": "ip",
+        "IpAddressType": "ipv4",
+        "LoadBalancerArns": []
+    }
+
+
+def fake_client(target_groups, tags=None, page_size=2):
+    tags = tags or {}
+    fake = mock.Mock()
+    fake.exceptions = SimpleNamespace(TargetGroupNotFoundException=type("TargetGroupNotFoundException", (Exception,), {}))
+    fake.can_paginate.return_value = False
+
+    def describe_target_groups(PageSize, Marker=None):
+        start = int(Marker or 0)
+        page = {"TargetGroups": target_groups[start:start + page_size]}
+        if start + page_size < len(target_groups):
+            page["NextMarker"] = str(start + page_size)
+        return page
+
+    fake.describe_target_groups.side_effect = describe_target_groups
+    fake.describe_tags.side_effect = lambda ResourceArns: {"TagDescriptions": [
+        {"ResourceArn": resource_arn, "Tags": [{"Key": k, "Value": v} for k, v in tags.get(resource_arn.split("/")[1], {}).items()]}
+        for resource_arn in ResourceArns
+    ]}
+    fake.describe_target_group_attributes.return_value = {"Attributes": [{"Key": "slow_start.duration_seconds", "Value": "0"}]}
+    fake.describe_target_health.side_effect = lambda TargetGroupArn: {"TargetHealthDescriptions": [
+        {"Target": {"Id": "10.0.0.1", "Port": 80}, "TargetHealth": {"State": "healthy"}}
+    ]}
+    return fake
+
+
+class RecordingExecutor:
+    # Runs inline and records the size of each batch handed to map
+    batch_sizes = []
+
+    def __init__(self, max_workers):
+        RecordingExecutor.batch_sizes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def map(self, fn, items):
+        RecordingExecutor.batch_sizes.append(len(items))
+        return [fn(item) for item in items]
+
+
+class MatchInventoryDefinitionTest(unittest.TestCase):
+
+    def test_first_matching_definition_wins(self):
+        definitions = {"web": {"name_pattern": "web-*"}, "everything": {}}
+        self.assertEqual(lambda_function.match_inventory_definition(target_group("web-a"), {}, definitions), "web")
+        self.assertEqual(lambda_function.match_inventory_definition(target_group("api-a"), {}, definitions), "everything")
+
+        definitions = {"everything": {}, "web": {"name_pattern": "web-*"}}
+        self.assertEqual(lambda_function.match_inventory_definition(target_group("web-a"), {}, definitions), "everything")
+
+    def test_tags_only_definitions_match_any_name(self):
+        definitions = {"api": {"tags": {"service": "api", "replicas": 2}}}
+        self.assertEqual(lambda_function.match_inventory_definition(target_group("anything"), {"service": "api", "replicas": "2"}, definitions), "api")
+        self.assertIsNone(lambda_function.match_inventory_definition(target_group("anything"), {"service": "web"}, definitions))
+        self.assertIsNone(lambda_function.match_inventory_definition(target_group("anything"), {}, definitions))
+
+
+class BatchingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.names = [f"tg-{i}" for i in range(45)]
+        self.client = fake_client([target_group(name) for name in self.names])
+        patcher = mock.patch.object(lambda_function, "client", self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_tags_are_read_20_arns_at_a_time(self):
+        tags_by_arn = lambda_function.describe_tags_batched([arn(name) for name in self.names])
+        self.assertEqual([len(call.kwargs["ResourceArns"]) for call in self.client.describe_tags.call_args_list], [20, 20, 5])
+        self.assertEqual(sorted(tags_by_arn), sorted(arn(name) for name in self.names))
+
+    def test_adoption_details_are_read_for_every_arn_in_batches(self):
+        self.client.describe_target_group_attributes.side_effect = lambda TargetGroupArn: {"Attributes": [{"Key": "name", "Value": TargetGroupArn.split("/")[1]}]}
+        with mock.patch.object(lambda_function, "ThreadPoolExecutor", RecordingExecutor):
+            details_by_arn = lambda_function.describe_adoption_details_batched([arn(name) for name in self.names])
+
+        self.assertEqual(RecordingExecutor.batch_sizes, [20, 20, 5])
+        self.assertEqual(len(details_by_arn), 45)
+        for name in self.names:
+            special_attributes, targets = details_by_arn[arn(name)]
+            self.assertEqual(special_attributes, {"name": name})
+            self.assertEqual(targets, [{"Id": "10.0.0.1", "Port": 80}])
+
+
+class InventoryTargetGroupsTest(unittest.TestCase):
+
+    def run_inventory(self, target_groups, definitions, tags=None):
+        self.client = fake_client(target_groups, tags)
+        with mock.patch.object(lambda_function, "client", self.client):
+            lambda_function.eh.capture_event({"op": "upsert", "prev_state": {}, "component_def": {}})
+            lambda_function.eh.add_op("inventory_target_groups", definitions)
+            lambda_function.inventory_target_groups()
+        return lambda_function.eh.props["inventory"]
+
+    def test_name_patterns_are_checked_before_any_tags_are_read(self):
+        inventory = self.run_inventory(
+            [target_group("web-a"), target_group("api-a"), target_group("web-b")],
+            {"web": {"name_pattern": "web-*", "tags": {"team": "a"}}},
+            tags={"web-a": {"team": "a"}, "api-a": {"team": "a"}, "web-b": {"team": "b"}}
+        )
+        self.assertEqual(list(inventory["web"]), ["web-a"])
+        tag_reads = [resource_arn for call in self.client.describe_tags.call_args_list for resource_arn in call.kwargs["ResourceArns"]]
+        self.assertEqual(tag_reads, [arn("web-a"), arn("web-b")])
+        # Attributes and health are only read for the groups that matched
+        self.client.describe_target_group_attributes.assert_called_once_with(TargetGroupArn=arn("web-a"))
+
+    def test_every_page_is_scanned_and_each_group_lands_in_one_definition(self):
+        inventory = self.run_inventory(
+            [target_group("web-a"), target_group("web-b"), target_group("api-a"), target_group("other")],
+            {"web": {"name_pattern": "web-*"}, "api": {"tags": {"service": "api"}}},
+            tags={"web-b": {"service": "api"}, "api-a": {"service": "api"}}
+        )
+        self.assertEqual(sorted(inventory["web"]), ["web-a", "web-b"])
+        self.assertEqual(list(inventory["api"]), ["api-a"])
+
+    def test_entries_can_be_used_as_prev_state_props(self):
+        inventory = self.run_inventory([target_group("web-a")], {"web": {}}, tags={"web-a": {"team": "a"}})
+        entry = inventory["web"]["web-a"]
+        self.assertEqual(entry, {
+            "name": "web-a",
+            "arn": arn("web-a"),
+            "vpc_id": "vpc-1",
+            "port": 80,
+            "load_balancer_arns": [],
+            "protocol": "HTTP",
+            "protocol_version": "HTTP1",
+            "target_type": "ip",
+            "ip_address_type": "ipv4",
+            "targets": [{"Id": "10.0.0.1", "Port": 80}],
+            "tags": {"team": "a"},
+            "special_attributes": {"slow_start.duration_seconds": "0"}
+        })
+
+        # Deploying the same definition on top of the adopted group changes nothing
+        definition_values = {"name": "web-a", "protocol": "HTTP", "protocol_version": "HTTP1", "port": 80, "vpc_id": "vpc-1", "target_type": "ip", "ip_address_type": "ipv4"}
+        self.assertEqual(lambda_function.changed_non_editable_fields(entry, definition_values), [])
+        self.assertEqual(lambda_function.diff_targets([{"Id": "10.0.0.1", "Port": 80}], entry["targets"]), ([], []))
+        self.assertEqual(lambda_function.prev_regions_from_props(entry), {"us-east-1": entry})
+
+
+if __name__ == "__main__":
+    unittest.main()
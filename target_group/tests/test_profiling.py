@@ -0,0 +1,82 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from unittest import mock
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lambda_function
+
+
+def build_report():
+    return {"rows": [str(i) for i in range(100)]}
+
+
+def deploy_regions():
+    return "done"
+
+
+class ProfiledTest(unittest.TestCase):
+
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir, ignore_errors=True)
+        patcher = mock.patch.object(lambda_function, "PROFILE_DIR", self.profile_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        lambda_function.eh.capture_event({"op": "upsert", "prev_state": {}, "component_def": {}})
+
+    def profile_logs(self):
+        return [call.args for call in self.add_log.call_args_list if call.args[0].startswith("Profile: ")]
+
+    def run_profiled_op(self, f, enabled=True):
+        with mock.patch.object(lambda_function, "profiling_enabled", enabled), \
+            mock.patch.object(lambda_function.eh, "add_log") as self.add_log:
+            return lambda_function.profiled(f)()
+
+    def test_does_nothing_while_off(self):
+        with mock.patch.object(lambda_function, "run_profiled") as run_profiled:
+            self.assertEqual(self.run_profiled_op(build_report, enabled=False), build_report())
+        run_profiled.assert_not_called()
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+    def test_writes_a_report_while_on(self):
+        self.assertEqual(self.run_profiled_op(build_report), build_report())
+        (title, report), = self.profile_logs()
+        self.assertEqual(title, "Profile: build_report")
+        self.assertGreater(report["peak_memory_bytes"], 0)
+        self.assertIn("largest_live_allocation_site", report)
+        self.assertEqual(report["profiled_threads"], "calling thread only")
+        self.assertTrue(any("build_report" in hotspot["function"] for hotspot in report["hotspots"]))
+        self.assertEqual(sorted(os.path.splitext(name)[1] for name in os.listdir(self.profile_dir)), [".prof", ".txt"])
+        self.assertFalse(lambda_function.tracemalloc.is_tracing())
+
+    def test_thread_pool_ops_say_their_workers_are_not_profiled(self):
+        self.run_profiled_op(deploy_regions)
+        (_, report), = self.profile_logs()
+        self.assertIn("thread pool", report["profiled_threads"])
+
+    def test_a_failed_report_never_raises(self):
+        with mock.patch.object(lambda_function.pstats, "Stats", side_effect=RuntimeError("broken")):
+            self.assertEqual(self.run_profiled_op(build_report), build_report())
+        self.assertEqual(self.profile_logs(), [])
+
+        with mock.patch.object(lambda_function, "PROFILE_DIR", os.path.join(self.profile_dir, "file")):
+            open(os.path.join(self.profile_dir, "file"), "w").close()
+            self.assertEqual(self.run_profiled_op(build_report), build_report())
+
+    def test_errors_from_the_op_still_propagate(self):
+        def fail():
+            raise ValueError("op failed")
+
+        with self.assertRaises(ValueError):
+            self.run_profiled_op(fail)
+        self.assertEqual(len(self.profile_logs()), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
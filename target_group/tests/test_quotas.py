@@ -0,0 +1,91 @@
+import os
+import sys
+import unittest
+
+from unittest import mock
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lambda_function
+
+LOAD_BALANCER_ARN = "arn:aws:elasticloadbalancing:us-east-1:000000000000:loadbalancer/app/web/1"
+
+
+class FakeElbv2Client:
+
+    def __init__(self, target_group_count, targets_per_group, limits=None):
+        self.meta = mock.Mock(region_name="us-east-1")
+        self.limits = limits or {"target-groups": 3000, "targets-per-application-load-balancer": 1000}
+        self.target_group_count = target_group_count
+        self.targets_per_group = targets_per_group
+        self.calls = []
+
+    def get_paginator(self, operation_name):
+        paginator = mock.Mock()
+        paginator.paginate.side_effect = lambda **params: self.paginate(operation_name, params)
+        return paginator
+
+    def paginate(self, operation_name, params):
+        self.calls.append(operation_name)
+        if operation_name == "describe_account_limits":
+            return [{"Limits": [{"Name": name, "Max": str(value)} for name, value in self.limits.items()]}]
+        if params.get("LoadBalancerArn"):
+            return [{"TargetGroups": [{"TargetGroupArn": f"tg-{i}"} for i in range(len(self.targets_per_group))]}]
+        return [{"TargetGroups": [{}] * self.target_group_count}]
+
+    def describe_target_health(self, TargetGroupArn):
+        self.calls.append("describe_target_health")
+        return {"TargetHealthDescriptions": [{}] * self.targets_per_group[int(TargetGroupArn.split("-")[1])]}
+
+
+class CheckQuotasTest(unittest.TestCase):
+
+    def setUp(self):
+        lambda_function.account_limits_cache.clear()
+        self.addCleanup(lambda_function.account_limits_cache.clear)
+
+    def test_reads_nothing_without_a_create_or_an_attached_load_balancer(self):
+        elbv2_client = FakeElbv2Client(10, [])
+        self.assertEqual(lambda_function.check_quotas(elbv2_client, False, 5, "HTTP", []), ([], {}))
+        self.assertEqual(elbv2_client.calls, [])
+
+    def test_create_needs_target_group_headroom(self):
+        self.assertEqual(lambda_function.check_quotas(FakeElbv2Client(2999, []), True, 0, "HTTP", [])[0], [])
+        lambda_function.account_limits_cache.clear()
+        problems, _ = lambda_function.check_quotas(FakeElbv2Client(3000, []), True, 0, "HTTP", [])
+        self.assertEqual(len(problems), 1)
+        self.assertIn("target-groups", problems[0])
+
+    def test_sums_targets_across_the_load_balancers_groups(self):
+        problems, targets_by_load_balancer = lambda_function.check_quotas(FakeElbv2Client(10, [600, 300]), False, 101, "HTTP", [LOAD_BALANCER_ARN])
+        self.assertEqual(targets_by_load_balancer, {LOAD_BALANCER_ARN: 900})
+        self.assertEqual(len(problems), 1)
+        self.assertIn("targets-per-application-load-balancer", problems[0])
+
+    def test_counts_are_cached_and_adjusted_after_registrations(self):
+        elbv2_client = FakeElbv2Client(10, [600, 300])
+        lambda_function.check_quotas(elbv2_client, False, 50, "HTTP", [LOAD_BALANCER_ARN])
+        calls = len(elbv2_client.calls)
+        lambda_function.adjust_cached_load_balancer_targets("us-east-1", [LOAD_BALANCER_ARN], 50)
+        problems, targets_by_load_balancer = lambda_function.check_quotas(elbv2_client, False, 51, "HTTP", [LOAD_BALANCER_ARN])
+        self.assertEqual(len(elbv2_client.calls), calls)
+        self.assertEqual(targets_by_load_balancer, {LOAD_BALANCER_ARN: 950})
+        self.assertEqual(len(problems), 1)
+
+    def test_counts_are_read_again_after_the_ttl(self):
+        elbv2_client = FakeElbv2Client(10, [10])
+        lambda_function.check_quotas(elbv2_client, False, 1, "HTTP", [LOAD_BALANCER_ARN])
+        calls = len(elbv2_client.calls)
+        with mock.patch.object(lambda_function, "ACCOUNT_LIMITS_TTL_SEC", 0):
+            lambda_function.check_quotas(elbv2_client, False, 1, "HTTP", [LOAD_BALANCER_ARN])
+        self.assertEqual(len(elbv2_client.calls), calls * 2)
+
+    def test_unmapped_protocols_skip_the_target_check(self):
+        elbv2_client = FakeElbv2Client(10, [10])
+        self.assertEqual(lambda_function.check_quotas(elbv2_client, False, 1, "GENEVE", [LOAD_BALANCER_ARN]), ([], {}))
+        self.assertEqual(elbv2_client.calls, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
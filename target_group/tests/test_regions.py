@@ -0,0 +1,275 @@
+import os
+import sys
+import unittest
+
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lambda_function
+
+ARN = "arn:aws:elasticloadbalancing:eu-west-1:000000000000:targetgroup/web/0123456789abcdef"
+LOAD_BALANCER_ARN = "arn:aws:elasticloadbalancing:eu-west-1:000000000000:loadbalancer/app/web/1"
+
+
+def client_error(operation_name, code="Throttling"):
+    return lambda_function.ClientError({"Error": {"Code": code, "Message": code}}, operation_name)
+
+
+def fake_regional_client():
+    regional_client = mock.Mock()
+    regional_client.exceptions = SimpleNamespace(
+        TargetGroupNotFoundException=type("TargetGroupNotFoundException", (Exception,), {}),
+        ResourceInUseException=type("ResourceInUseException", (Exception,), {})
+    )
+    regional_client.can_paginate.return_value = False
+    regional_client.describe_target_groups.return_value = {"TargetGroups": [{"TargetGroupArn": ARN, "LoadBalancerArns": []}]}
+    regional_client.describe_target_health.return_value = {"TargetHealthDescriptions": []}
+    regional_client.deregister_targets.return_value = {}
+    return regional_client
+
+
+class RegionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.regional_client = fake_regional_client()
+        for patcher in [
+            mock.patch.object(lambda_function, "get_regional_client", return_value=self.regional_client),
+            mock.patch.object(lambda_function, "check_quotas", return_value=([], {}))
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class DiffTest(unittest.TestCase):
+
+    def test_diff_targets(self):
+        targets = [{"Id": "10.0.0.1", "Port": 80}, {"Id": "10.0.0.2", "Port": 80, "AvailabilityZone": "all"}]
+        prev_targets = [{"Id": "10.0.0.1", "Port": 80}, {"Id": "10.0.0.3", "Port": 80}]
+        self.assertEqual(lambda_function.diff_targets(targets, prev_targets), ([{"Id": "10.0.0.2", "Port": 80, "AvailabilityZone": "all"}], ["10.0.0.3"]))
+        self.assertEqual(lambda_function.diff_targets(None, prev_targets), ([], ["10.0.0.1", "10.0.0.3"]))
+        self.assertEqual(lambda_function.diff_targets([{"Id": "i-1"}], None), ([{"Id": "i-1"}], []))
+
+    def test_diff_tags(self):
+        tags = [{"Key": "team", "Value": "a"}, {"Key": "env", "Value": "prod"}]
+        self.assertEqual(lambda_function.diff_tags(tags, {"team": "a", "env": "dev", "old": "x"}), (["old"], {"env": "prod"}))
+        self.assertEqual(lambda_function.diff_tags(None, {"old": "x"}), (["old"], {}))
+
+    def test_special_attributes_to_write(self):
+        current = {"slow_start.duration_seconds": "30", "stickiness.enabled": "true", "unknown": "x"}
+        defaults = {"slow_start.duration_seconds": "0", "stickiness.enabled": "false"}
+        self.assertEqual(
+            lambda_function.special_attributes_to_write({"stickiness.enabled": "true"}, defaults, current),
+            {"slow_start.duration_seconds": "0", "stickiness.enabled": "true"}
+        )
+        self.assertEqual(lambda_function.special_attributes_to_write(None, defaults, current), defaults)
+
+
+class ChangedNonEditableFieldsTest(unittest.TestCase):
+
+    definition_values = {"name": "web", "protocol": "HTTP", "port": 80, "vpc_id": None, "target_type": "ip"}
+    deployed = {"name": "web", "arn": ARN, "protocol": "HTTP", "port": 80, "vpc_id": "vpc-1", "target_type": "ip"}
+
+    def test_single_region(self):
+        self.assertEqual(lambda_function.changed_non_editable_fields(self.deployed, {**self.definition_values, "vpc_id": "vpc-1"}), [])
+        self.assertEqual(lambda_function.changed_non_editable_fields(self.deployed, {**self.definition_values, "vpc_id": "vpc-1", "port": 8080}), ["port"])
+
+    def test_each_region_is_checked_against_its_own_vpc_id(self):
+        prev_props = {"name": "web", "regions": {"eu-west-1": self.deployed, "us-east-1": {**self.deployed, "vpc_id": "vpc-2"}}}
+        regions = {"eu-west-1": {"vpc_id": "vpc-1"}, "us-east-1": {"vpc_id": "vpc-2"}}
+        self.assertEqual(lambda_function.changed_non_editable_fields(prev_props, self.definition_values, regions), [])
+
+        changed = lambda_function.changed_non_editable_fields(prev_props, {**self.definition_values, "port": 8080, "protocol": "HTTPS"}, regions)
+        self.assertEqual(sorted(changed), ["port (eu-west-1)", "port (us-east-1)", "protocol (eu-west-1)", "protocol (us-east-1)"])
+        changed = lambda_function.changed_non_editable_fields(prev_props, self.definition_values, {**regions, "us-east-1": {"vpc_id": "vpc-3"}})
+        self.assertEqual(changed, ["vpc_id (us-east-1)"])
+
+    def test_regions_without_a_vpc_id_use_the_top_level_one(self):
+        prev_props = {"name": "web", "regions": {"eu-west-1": self.deployed}}
+        self.assertEqual(lambda_function.changed_non_editable_fields(prev_props, {**self.definition_values, "vpc_id": "vpc-1"}, {"eu-west-1": {}}), [])
+
+    def test_regions_only_recorded_by_arn_or_being_dropped_are_skipped(self):
+        prev_props = {"name": "web", "regions": {"eu-west-1": {"name": "web", "arn": ARN}, "us-east-1": {**self.deployed, "port": 443}}}
+        self.assertEqual(lambda_function.changed_non_editable_fields(prev_props, self.definition_values, {"eu-west-1": {"vpc_id": "vpc-9"}}), [])
+
+    def test_moving_a_single_region_component_to_regions(self):
+        # The existing group is compared against the entry for its own region, eu-west-1 from the arn
+        regions = {"eu-west-1": {"vpc_id": "vpc-1"}, "us-east-1": {"vpc_id": "vpc-2"}}
+        self.assertEqual(lambda_function.changed_non_editable_fields(self.deployed, self.definition_values, regions), [])
+        self.assertEqual(lambda_function.changed_non_editable_fields(self.deployed, self.definition_values, {"eu-west-1": {"vpc_id": "vpc-2"}}), ["vpc_id (eu-west-1)"])
+
+
+class CreateTargetGroupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = fake_regional_client()
+        self.client.create_target_group.return_value = {"TargetGroups": [{"TargetGroupArn": ARN, "TargetGroupName": "web"}]}
+        # waf.fail_open.enabled has no default, like any attribute AWS adds after the defaults were written down
+        self.client.describe_target_group_attributes.return_value = {"Attributes": [
+            {"Key": "stickiness.enabled", "Value": "false"},
+            {"Key": "waf.fail_open.enabled", "Value": "false"}
+        ]}
+        self.client.describe_tags.return_value = {"TagDescriptions": []}
+        patcher = mock.patch.object(lambda_function, "client", self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        lambda_function.eh.capture_event({"op": "upsert", "prev_state": {}, "component_def": {}})
+        lambda_function.eh.add_op("create_target_group")
+
+    def test_attributes_without_a_default_are_not_written(self):
+        lambda_function.create_target_group(
+            {"Name": "web", "Protocol": "HTTP", "Port": 80, "VpcId": "vpc-1"}, None, {"stickiness.enabled": "true"},
+            {"stickiness.enabled": "false"}, "eu-west-1", {}
+        )
+        self.assertEqual(lambda_function.eh.state["update_special_attributes"], {"stickiness.enabled": "true"})
+
+        lambda_function.update_target_group_special_attributes()
+        self.client.modify_target_group_attributes.assert_called_once_with(TargetGroupArn=ARN, Attributes=[{"Key": "stickiness.enabled", "Value": "true"}])
+
+
+class DeployTargetGroupInRegionTest(RegionTestCase):
+
+    attributes = {"Name": "web", "Protocol": "HTTP", "Port": 80, "VpcId": "vpc-1", "Tags": [{"Key": "team", "Value": "a"}]}
+
+    def deploy(self, targets, created_target_groups, prev_region_props=None):
+        return lambda_function.deploy_target_group_in_region(
+            "eu-west-1", self.attributes, targets, {}, {"slow_start.duration_seconds": "0"}, prev_region_props or {}, created_target_groups
+        )
+
+    def test_records_a_created_group_before_later_calls_fail(self):
+        self.regional_client.describe_target_groups.side_effect = self.regional_client.exceptions.TargetGroupNotFoundException()
+        self.regional_client.create_target_group.return_value = {"TargetGroups": [{"TargetGroupArn": ARN, "TargetGroupName": "web"}]}
+        self.regional_client.register_targets.side_effect = client_error("RegisterTargets")
+        created_target_groups = {}
+        with self.assertRaises(lambda_function.ClientError):
+            self.deploy([{"Id": "10.0.0.1"}], created_target_groups)
+        self.assertEqual(created_target_groups, {"eu-west-1": {"name": "web", "arn": ARN}})
+
+    def test_updates_an_existing_group_the_way_the_single_region_ops_do(self):
+        self.regional_client.modify_target_group.return_value = {"TargetGroups": [{"TargetGroupArn": ARN, "TargetGroupName": "web"}]}
+        self.regional_client.describe_target_group_attributes.return_value = {"Attributes": [{"Key": "slow_start.duration_seconds", "Value": "0"}]}
+        self.regional_client.describe_tags.return_value = {"TagDescriptions": [{"ResourceArn": ARN, "Tags": [{"Key": "old", "Value": "x"}]}]}
+        created_target_groups = {}
+        result = self.deploy([{"Id": "10.0.0.2"}], created_target_groups, {"targets": [{"Id": "10.0.0.1"}]})
+
+        self.assertEqual(created_target_groups, {})
+        self.regional_client.create_target_group.assert_not_called()
+        # Everything in the definition is create-only here, so only the arn goes out
+        self.regional_client.modify_target_group.assert_called_once_with(TargetGroupArn=ARN)
+        self.regional_client.deregister_targets.assert_called_once_with(TargetGroupArn=ARN, Targets=[{"Id": "10.0.0.1"}])
+        self.regional_client.register_targets.assert_called_once_with(TargetGroupArn=ARN, Targets=[{"Id": "10.0.0.2"}])
+        # The full set is written, even when it matches what is there, like update/reset_target_group_special_attributes
+        self.regional_client.modify_target_group_attributes.assert_called_once_with(TargetGroupArn=ARN, Attributes=[{"Key": "slow_start.duration_seconds", "Value": "0"}])
+        self.regional_client.remove_tags.assert_called_once_with(ResourceArns=[ARN], TagKeys=["old"])
+        self.regional_client.add_tags.assert_called_once_with(ResourceArns=[ARN], Tags=[{"Key": "team", "Value": "a"}])
+        self.assertEqual(result["arn"], ARN)
+
+
+class DeployRegionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.outcomes = {}
+        for patcher in [
+            mock.patch.object(lambda_function, "deploy_target_group_in_region", side_effect=self.deploy_in_region),
+            mock.patch.object(lambda_function.eh, "retry_error"),
+            mock.patch.object(lambda_function.eh, "perm_error")
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        lambda_function.eh.capture_event({"op": "upsert", "prev_state": {}, "component_def": {}})
+
+    def deploy_in_region(self, region, attributes, targets, special_attributes, default_special_attributes, prev_region_props, created_target_groups):
+        outcome = self.outcomes[region]
+        if isinstance(outcome, Exception):
+            # The group was created before the failure, as in deploy_target_group_in_region
+            created_target_groups[region] = {"name": "web", "arn": ARN.replace("eu-west-1", region)}
+            raise outcome
+        return outcome
+
+    def deploy(self, outcomes):
+        self.outcomes = outcomes
+        lambda_function.eh.add_op("deploy_regions", {region: {} for region in outcomes})
+        lambda_function.deploy_regions({"Name": "web"}, None, {}, {}, {})
+
+    def test_a_bad_definition_fails_the_deployment_without_retrying(self):
+        for error in [
+            client_error("CreateTargetGroup", "ValidationError"),
+            client_error("CreateTargetGroup", "DuplicateTargetGroupName"),
+            lambda_function.botocore.exceptions.ParamValidationError(report="Invalid type for parameter"),
+            lambda_function.RegionQuotaError("no headroom")
+        ]:
+            lambda_function.eh.retry_error.reset_mock()
+            lambda_function.eh.perm_error.reset_mock()
+            self.deploy({"eu-west-1": {"name": "web", "arn": ARN}, "us-east-1": error})
+            lambda_function.eh.retry_error.assert_not_called()
+            lambda_function.eh.perm_error.assert_called_once()
+            self.assertIn("us-east-1", lambda_function.eh.perm_error.call_args.args[0])
+
+    def test_transient_errors_are_retried(self):
+        self.deploy({"eu-west-1": {"name": "web", "arn": ARN}, "us-east-1": client_error("CreateTargetGroup")})
+        lambda_function.eh.perm_error.assert_not_called()
+        lambda_function.eh.retry_error.assert_called_once()
+        self.assertEqual(list(lambda_function.eh.state["region_results"]), ["eu-west-1"])
+
+    def test_unexpected_errors_keep_the_created_groups_in_state_and_props(self):
+        self.deploy({"us-east-1": KeyError("TargetGroups")})
+        created = {"us-east-1": {"name": "web", "arn": ARN.replace("eu-west-1", "us-east-1")}}
+        self.assertEqual(lambda_function.eh.state["region_created_target_groups"], created)
+        self.assertEqual(lambda_function.eh.props["regions"], created)
+        lambda_function.eh.retry_error.assert_called_once()
+
+
+class TeardownStepInRegionTest(RegionTestCase):
+
+    def step(self, teardown):
+        return lambda_function.teardown_step_in_region("eu-west-1", ARN, teardown)
+
+    def test_runs_straight_through_when_nothing_is_attached(self):
+        self.regional_client.describe_target_health.return_value = {"TargetHealthDescriptions": [
+            {"Target": {"Id": "10.0.0.1", "Port": 80}, "TargetHealth": {"State": "healthy"}},
+            {"Target": {"Id": "10.0.0.2", "Port": 80}, "TargetHealth": {"State": "draining"}}
+        ]}
+        teardown = self.step({"stage": "describe"})
+        self.assertEqual(teardown["stage"], "done")
+        self.regional_client.deregister_targets.assert_called_once_with(TargetGroupArn=ARN, Targets=[{"Id": "10.0.0.1", "Port": 80}])
+        self.regional_client.delete_target_group.assert_called_once_with(TargetGroupArn=ARN)
+
+    def test_waits_for_load_balancers_before_deregistering(self):
+        self.regional_client.describe_target_groups.return_value = {"TargetGroups": [{"TargetGroupArn": ARN, "LoadBalancerArns": [LOAD_BALANCER_ARN]}]}
+        teardown = self.step({"stage": "describe"})
+        self.assertEqual((teardown["stage"], teardown["polls"], teardown["callback_sec"]), ("wait", 1, lambda_function.LISTENER_DETACHMENT_BASE_SEC))
+        teardown = self.step(teardown)
+        self.assertEqual((teardown["polls"], teardown["callback_sec"]), (2, lambda_function.LISTENER_DETACHMENT_BASE_SEC * 2))
+        self.regional_client.deregister_targets.assert_not_called()
+
+        self.regional_client.describe_target_groups.return_value = {"TargetGroups": [{"TargetGroupArn": ARN, "LoadBalancerArns": []}]}
+        teardown = self.step(teardown)
+        self.assertEqual(teardown["stage"], "done")
+        self.assertNotIn("callback_sec", teardown)
+
+    def test_fails_after_the_max_polls(self):
+        self.regional_client.describe_target_groups.return_value = {"TargetGroups": [{"TargetGroupArn": ARN, "LoadBalancerArns": [LOAD_BALANCER_ARN]}]}
+        teardown = self.step({"stage": "wait", "load_balancer_arns": [LOAD_BALANCER_ARN], "polls": lambda_function.LISTENER_DETACHMENT_MAX_POLLS, "backoff_step": 5})
+        self.assertEqual(teardown["stage"], "failed")
+        self.assertIn(LOAD_BALANCER_ARN, teardown["error"])
+
+    def test_goes_back_to_waiting_when_the_delete_finds_it_in_use(self):
+        self.regional_client.delete_target_group.side_effect = self.regional_client.exceptions.ResourceInUseException()
+        teardown = self.step({"stage": "delete", "polls": 3, "backoff_step": 3})
+        self.assertEqual((teardown["stage"], teardown["callback_sec"]), ("wait", lambda_function.LISTENER_DETACHMENT_BASE_SEC))
+
+    def test_keeps_only_the_targets_that_failed_to_deregister(self):
+        self.regional_client.deregister_targets.side_effect = client_error("DeregisterTargets")
+        teardown = self.step({"stage": "deregister", "targets": [{"Id": "10.0.0.1"}]})
+        self.assertEqual((teardown["stage"], teardown["targets"]), ("deregister", [{"Id": "10.0.0.1"}]))
+        self.assertIn("error", teardown)
+
+    def test_a_missing_group_is_already_deleted(self):
+        self.regional_client.describe_target_groups.side_effect = self.regional_client.exceptions.TargetGroupNotFoundException()
+        self.assertEqual(self.step({"stage": "describe"})["stage"], "done")
+
+
+if __name__ == "__main__":
+    unittest.main()
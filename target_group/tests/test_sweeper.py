@@ -0,0 +1,221 @@
+import os
+import sys
+import unittest
+
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lambda_function
+
+NOW = 1700000000
+HOUR = 3600
+
+
+def target_group(name, load_balancer_arns=None):
+    return {
+        "TargetGroupName": name,
+        "TargetGroupArn": f"arn:aws:elasticloadbalancing:us-east-1:000000000000:targetgroup/{name}/0123456789abcdef",
+        "LoadBalancerArns": load_balancer_arns or []
+    }
+
+
+class FindOrphanedTargetGroupsTest(unittest.TestCase):
+
+    def find(self, target_groups, config, tags=None, registered=()):
+        tags = tags or {}
+        with mock.patch.object(lambda_function, "current_epoch_time_usec_num", return_value=NOW * 1000000), \
+            mock.patch.object(lambda_function, "describe_tags_batched", side_effect=lambda arns: {arn: tags.get(arn.split("/")[1], {}) for arn in arns}), \
+            mock.patch.object(lambda_function, "iter_target_health", side_effect=lambda arn: iter([{"Target": {"Id": "i-1"}}] if arn.split("/")[1] in registered else [])):
+            return [item["TargetGroupName"] for item in lambda_function.find_orphaned_target_groups(target_groups, config)]
+
+    def test_skips_target_groups_used_by_a_load_balancer(self):
+        target_groups = [target_group("attached", ["arn:aws:elasticloadbalancing:us-east-1:000000000000:loadbalancer/app/lb/1"]), target_group("free")]
+        self.assertEqual(self.find(target_groups, {}), ["free"])
+
+    def test_skips_target_groups_with_registered_targets(self):
+        self.assertEqual(self.find([target_group("busy"), target_group("empty")], {}, registered={"busy"}), ["empty"])
+
+    def test_matches_name_pattern(self):
+        target_groups = [target_group("team-a-web"), target_group("team-b-web")]
+        self.assertEqual(self.find(target_groups, {"name_pattern": "team-a-*"}), ["team-a-web"])
+
+    def test_requires_every_owner_tag(self):
+        tags = {
+            "both": {"team": "a", "env": "dev"},
+            "one": {"team": "a"},
+            "other": {"team": "b", "env": "dev"}
+        }
+        target_groups = [target_group("both"), target_group("one"), target_group("other")]
+        self.assertEqual(self.find(target_groups, {"owner_tags": {"team": "a", "env": "dev"}}, tags=tags), ["both"])
+
+    def test_min_age_reads_the_created_at_tag(self):
+        tags = {
+            "old-epoch": {"created_at": str(NOW - 48 * HOUR)},
+            "old-iso": {"created_at": "2023-11-12T00:00:00Z"},
+            "young": {"created_at": str(NOW - HOUR)},
+            "untagged": {},
+            "unreadable": {"created_at": "last tuesday"}
+        }
+        target_groups = [target_group(name) for name in tags]
+        self.assertEqual(self.find(target_groups, {"min_age_hours": 24}, tags=tags), ["old-epoch", "old-iso"])
+
+    def test_min_age_uses_the_configured_tag(self):
+        tags = {"custom": {"born": str(NOW - 48 * HOUR)}, "default": {"created_at": str(NOW - 48 * HOUR)}}
+        target_groups = [target_group("custom"), target_group("default")]
+        self.assertEqual(self.find(target_groups, {"min_age_hours": 24, "created_at_tag": "born"}, tags=tags), ["custom"])
+
+
+class FakeSweepClient:
+    # Pages are keyed by the name of their first group, like an opaque marker that survives deletes before it
+
+    def __init__(self, names, owned, in_use=()):
+        self.target_groups = {name: target_group(name) for name in names}
+        self.owned = set(owned)
+        self.in_use = set(in_use)
+        self.deletes = []
+        self.meta = SimpleNamespace(region_name="us-east-1")
+        self.exceptions = SimpleNamespace(
+            TargetGroupNotFoundException=type("TargetGroupNotFoundException", (Exception,), {}),
+            ResourceInUseException=type("ResourceInUseException", (Exception,), {})
+        )
+
+    def describe_target_groups(self, PageSize, Marker=None):
+        names = sorted(name for name in self.target_groups if Marker is None or name >= Marker)
+        response = {"TargetGroups": [self.target_groups[name] for name in names[:PageSize]]}
+        if len(names) > PageSize:
+            response["NextMarker"] = names[PageSize]
+        return response
+
+    def describe_tags(self, ResourceArns):
+        return {"TagDescriptions": [{
+            "ResourceArn": arn,
+            "Tags": [{"Key": "team", "Value": "a"}, {"Key": "created_at", "Value": str(NOW - 48 * HOUR)}] if arn.split("/")[1] in self.owned else []
+        } for arn in ResourceArns]}
+
+    def can_paginate(self, operation_name):
+        return False
+
+    def describe_target_health(self, TargetGroupArn):
+        return {"TargetHealthDescriptions": []}
+
+    def delete_target_group(self, TargetGroupArn):
+        name = TargetGroupArn.split("/")[1]
+        self.deletes.append(name)
+        if name in self.in_use:
+            raise self.exceptions.ResourceInUseException(name)
+        del self.target_groups[name]
+
+
+class SweepOrphanedTargetGroupsTest(unittest.TestCase):
+
+    config = {"dry_run": False, "owner_tags": {"team": "a"}, "min_age_hours": 24, "deletes_per_second": 1000}
+
+    def setUp(self):
+        self.names = [f"tg-{i:02d}" for i in range(45)]
+        # Every third group belongs to someone else
+        self.client = FakeSweepClient(self.names, owned=[name for i, name in enumerate(self.names) if i % 3], in_use=["tg-07"])
+        for patcher in [
+            mock.patch.object(lambda_function, "client", self.client),
+            mock.patch.object(lambda_function, "SWEEP_PAGE_SIZE", 10),
+            mock.patch.object(lambda_function, "current_epoch_time_usec_num", return_value=NOW * 1000000),
+            mock.patch.object(lambda_function.eh, "retry_error")
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        lambda_function.eh.capture_event({"op": "upsert", "prev_state": {}, "component_def": {}})
+
+    def sweep(self, config, deletes_per_invocation):
+        # Each invocation runs out of time after a few deletes and resumes from the checkpoint in state
+        for invocations in range(1, 100):
+            deletes_before = len(self.client.deletes)
+            context = mock.Mock()
+            context.get_remaining_time_in_millis.side_effect = lambda: 0 if len(self.client.deletes) - deletes_before >= deletes_per_invocation else 600000
+            lambda_function.eh.add_op("sweep_orphaned_target_groups", config)
+            lambda_function.sweep_orphaned_target_groups(context)
+            if lambda_function.eh.props.get("sweep_report"):
+                return lambda_function.eh.props["sweep_report"], invocations
+        self.fail("The sweep never finished")
+
+    def test_resumes_mid_page_and_counts_each_group_once(self):
+        report, invocations = self.sweep(self.config, deletes_per_invocation=4)
+        self.assertGreater(invocations, 1)
+        self.assertEqual(report["scanned"], 45)
+        self.assertEqual(report["orphans"], 30)
+        self.assertEqual(report["deleted"], 29)
+        self.assertEqual(list(report["failed"]), ["tg-07"])
+        # Every orphan is tried exactly once, including the one that was in use
+        self.assertEqual(sorted(self.client.deletes), sorted(report["orphan_names"]))
+        self.assertEqual(sorted(self.client.target_groups), sorted([name for i, name in enumerate(self.names) if i % 3 == 0] + ["tg-07"]))
+        self.assertIsNone(lambda_function.eh.state["sweep_checkpoint"])
+
+    def test_a_dry_run_reports_without_deleting(self):
+        report, invocations = self.sweep({**self.config, "dry_run": True}, deletes_per_invocation=4)
+        self.assertEqual(invocations, 1)
+        self.assertEqual((report["scanned"], report["orphans"], report["deleted"]), (45, 30, 0))
+        self.assertEqual(self.client.deletes, [])
+
+    def test_an_unscoped_sweep_is_refused(self):
+        with mock.patch.object(lambda_function.eh, "perm_error") as perm_error:
+            lambda_function.eh.add_op("sweep_orphaned_target_groups", {"dry_run": False, "owner_tags": {"team": "a"}})
+            lambda_function.sweep_orphaned_target_groups(mock.Mock())
+        perm_error.assert_called_once()
+        self.assertEqual(self.client.deletes, [])
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.multiple(lambda_function.time, monotonic=self.clock.monotonic, sleep=self.clock.sleep)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_bursts_up_to_capacity_without_waiting(self):
+        bucket = lambda_function.TokenBucket(2)
+        bucket.acquire()
+        bucket.acquire()
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_waits_for_the_next_token_once_empty(self):
+        bucket = lambda_function.TokenBucket(2)
+        for _ in range(3):
+            bucket.acquire()
+        self.assertEqual(self.clock.sleeps, [0.5])
+
+    def test_refills_at_the_rate_while_idle(self):
+        bucket = lambda_function.TokenBucket(1, capacity=3)
+        for _ in range(3):
+            bucket.acquire()
+        self.clock.now += 2
+        bucket.acquire()
+        bucket.acquire()
+        self.assertEqual(self.clock.sleeps, [])
+        bucket.acquire()
+        self.assertEqual(self.clock.sleeps, [1.0])
+
+    def test_fractional_rates_keep_a_capacity_of_one(self):
+        bucket = lambda_function.TokenBucket(0.5)
+        bucket.acquire()
+        bucket.acquire()
+        self.assertEqual(self.clock.sleeps, [2.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,181 @@
+import os
+import sys
+import unittest
+
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lambda_function
+
+ARN = "arn:aws:elasticloadbalancing:us-east-1:000000000000:targetgroup/web/0123456789abcdef"
+LOAD_BALANCER_ARNS = [f"arn:aws:elasticloadbalancing:us-east-1:000000000000:loadbalancer/app/web/{i}" for i in range(2)]
+
+
+def client_error(operation_name, code="Throttling"):
+    return lambda_function.ClientError({"Error": {"Code": code, "Message": code}}, operation_name)
+
+
+class TeardownTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.client = mock.Mock()
+        self.client.meta.region_name = "us-east-1"
+        self.client.exceptions = SimpleNamespace(
+            TargetGroupNotFoundException=type("TargetGroupNotFoundException", (Exception,), {}),
+            ResourceInUseException=type("ResourceInUseException", (Exception,), {})
+        )
+        self.client.can_paginate.return_value = False
+        self.client.describe_target_health.return_value = {"TargetHealthDescriptions": []}
+        self.attach()
+        # Every clock read moves time forward by a millisecond
+        self.now_usec = 1700000000 * 1000000
+        self.retry_error = mock.Mock()
+        self.perm_error = mock.Mock()
+        self.handle_common_errors = mock.Mock()
+        for patcher in [
+            mock.patch.object(lambda_function, "client", self.client),
+            mock.patch.object(lambda_function, "current_epoch_time_usec_num", side_effect=self.tick),
+            mock.patch.object(lambda_function, "handle_common_errors", self.handle_common_errors),
+            mock.patch.object(lambda_function.eh, "retry_error", self.retry_error),
+            mock.patch.object(lambda_function.eh, "perm_error", self.perm_error)
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        lambda_function.eh.capture_event({"op": "delete", "prev_state": {}, "component_def": {}})
+        lambda_function.eh.add_state({"target_group_arn": ARN, "region": "us-east-1"})
+
+    def tick(self):
+        self.now_usec += 1000
+        return self.now_usec
+
+    def attach(self, *load_balancer_arns):
+        self.client.describe_target_groups.return_value = {"TargetGroups": [{"TargetGroupArn": ARN, "LoadBalancerArns": list(load_balancer_arns)}]}
+
+    def run_op(self, op, value=True):
+        # The errors are mocked out, so each step re-queues its op the way a retry would
+        lambda_function.eh.add_op(op, value)
+        getattr(lambda_function, op)()
+
+    def callbacks(self):
+        return [call.kwargs.get("callback_sec") for call in self.retry_error.call_args_list]
+
+
+class GetTargetGroupForDeleteTest(TeardownTestCase):
+
+    def test_plans_only_the_stages_that_are_needed(self):
+        self.client.describe_target_health.return_value = {"TargetHealthDescriptions": [
+            {"Target": {"Id": "10.0.0.1", "Port": 80}, "TargetHealth": {"State": "healthy"}},
+            {"Target": {"Id": "10.0.0.2", "Port": 80}, "TargetHealth": {"State": "draining"}}
+        ]}
+        self.run_op("get_target_group_for_delete")
+        self.assertNotIn("wait_for_listener_detachment", lambda_function.eh.ops)
+        self.assertEqual(lambda_function.eh.ops.get("deregister_all_targets"), [{"Id": "10.0.0.1", "Port": 80}])
+        self.assertIn("delete_target_group", lambda_function.eh.ops)
+
+    def test_waits_for_attached_load_balancers(self):
+        self.attach(*LOAD_BALANCER_ARNS)
+        self.run_op("get_target_group_for_delete")
+        self.assertIn("wait_for_listener_detachment", lambda_function.eh.ops)
+        self.assertNotIn("deregister_all_targets", lambda_function.eh.ops)
+        self.assertEqual(lambda_function.eh.state["load_balancer_arns"], LOAD_BALANCER_ARNS)
+
+
+class WaitForListenerDetachmentTest(TeardownTestCase):
+
+    def setUp(self):
+        super().setUp()
+        lambda_function.eh.add_state({"load_balancer_arns": LOAD_BALANCER_ARNS})
+
+    def test_backs_off_until_a_load_balancer_lets_go(self):
+        base_sec = lambda_function.LISTENER_DETACHMENT_BASE_SEC
+        self.attach(*LOAD_BALANCER_ARNS)
+        for _ in range(3):
+            self.run_op("wait_for_listener_detachment")
+        self.assertEqual(self.callbacks(), [base_sec, base_sec * 2, base_sec * 4])
+
+        # One load balancer let go, so the next poll comes quickly again
+        self.attach(LOAD_BALANCER_ARNS[1])
+        self.run_op("wait_for_listener_detachment")
+        self.assertEqual(self.callbacks()[-1], base_sec)
+        self.assertEqual(lambda_function.eh.state["detachment_polls"], 4)
+
+        self.attach()
+        self.run_op("wait_for_listener_detachment")
+        self.assertEqual(len(self.callbacks()), 4)
+        self.perm_error.assert_not_called()
+
+    def test_backoff_is_capped(self):
+        callback_sec, _ = lambda_function.next_detachment_backoff(LOAD_BALANCER_ARNS, LOAD_BALANCER_ARNS, 10)
+        self.assertEqual(callback_sec, lambda_function.LISTENER_DETACHMENT_MAX_SEC)
+
+    def test_fails_after_the_max_polls(self):
+        self.attach(LOAD_BALANCER_ARNS[0])
+        lambda_function.eh.add_state({"detachment_polls": lambda_function.LISTENER_DETACHMENT_MAX_POLLS})
+        self.run_op("wait_for_listener_detachment")
+        self.retry_error.assert_not_called()
+        self.perm_error.assert_called_once()
+        self.assertIn(LOAD_BALANCER_ARNS[0], self.perm_error.call_args.args[0])
+
+
+class DeleteTargetGroupTest(TeardownTestCase):
+
+    def test_goes_back_to_polling_when_the_delete_finds_it_in_use(self):
+        self.client.delete_target_group.side_effect = self.client.exceptions.ResourceInUseException()
+        self.run_op("delete_target_group")
+        self.assertIn("wait_for_listener_detachment", lambda_function.eh.ops)
+        self.assertEqual(self.callbacks(), [lambda_function.LISTENER_DETACHMENT_BASE_SEC])
+        self.assertNotIn("delete", lambda_function.eh.state.get("teardown_timings_ms") or {})
+
+
+class DeregisterAllTargetsTest(TeardownTestCase):
+
+    def test_a_retry_resends_only_the_failed_chunks(self):
+        targets = [{"Id": f"10.0.{i // 100}.{i % 100}"} for i in range(250)]
+        failing_chunk = targets[100:200]
+
+        def deregister_targets(TargetGroupArn, Targets):
+            if Targets == failing_chunk:
+                raise client_error("DeregisterTargets")
+            return {}
+
+        self.client.deregister_targets.side_effect = deregister_targets
+
+        self.run_op("deregister_all_targets", targets)
+        self.assertEqual(self.client.deregister_targets.call_count, 3)
+        self.handle_common_errors.assert_called_once()
+        self.assertEqual(lambda_function.eh.state["targets_to_deregister"], failing_chunk)
+
+        self.client.deregister_targets.reset_mock()
+        self.client.deregister_targets.side_effect = None
+        self.run_op("deregister_all_targets", targets)
+        self.client.deregister_targets.assert_called_once_with(TargetGroupArn=ARN, Targets=failing_chunk)
+        self.assertIsNone(lambda_function.eh.state["targets_to_deregister"])
+
+
+class TeardownTimingsTest(TeardownTestCase):
+
+    def test_each_stage_is_timed_across_its_retries(self):
+        self.attach(LOAD_BALANCER_ARNS[0])
+        self.client.describe_target_health.return_value = {"TargetHealthDescriptions": [{"Target": {"Id": "10.0.0.1"}, "TargetHealth": {"State": "healthy"}}]}
+        self.run_op("get_target_group_for_delete")
+        self.run_op("wait_for_listener_detachment")
+        # The listener takes ten seconds to let go
+        self.now_usec += 10 * 1000000
+        self.attach()
+        self.run_op("wait_for_listener_detachment")
+        self.run_op("deregister_all_targets", [{"Id": "10.0.0.1"}])
+        self.run_op("delete_target_group")
+
+        timings = lambda_function.eh.state["teardown_timings_ms"]
+        self.assertEqual(sorted(timings), ["delete", "deregister", "describe", "wait_for_listener_detachment"])
+        self.assertGreaterEqual(timings["wait_for_listener_detachment"], 10000)
+        for stage in ["describe", "deregister", "delete"]:
+            self.assertLess(timings[stage], 1000)
+        self.client.delete_target_group.assert_called_once_with(TargetGroupArn=ARN)
+
+
+if __name__ == "__main__":
+    unittest.main()
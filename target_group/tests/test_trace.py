@@ -0,0 +1,94 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lambda_function
+import trace_replay
+
+
+class RedactTest(unittest.TestCase):
+
+    def test_redacts_secret_looking_keys_at_any_depth(self):
+        value = {"Name": "web", "Nested": [{"api_key": "abc", "ClientSecret": "def", "Port": 80}]}
+        self.assertEqual(lambda_function.redact(value), {"Name": "web", "Nested": [{"api_key": "**REDACTED**", "ClientSecret": "**REDACTED**", "Port": 80}]})
+
+    def test_redacts_tag_values_whose_key_looks_secret(self):
+        tags = [{"Key": "db_password", "Value": "hunter2"}, {"Key": "team", "Value": "a"}]
+        self.assertEqual(lambda_function.redact(tags), [{"Key": "db_password", "Value": "**REDACTED**"}, {"Key": "team", "Value": "a"}])
+
+    def test_leaves_scalars_alone(self):
+        self.assertEqual(lambda_function.redact("token"), "token")
+
+
+def call_record(operation, params, response, region="us-east-1"):
+    return {"type": "call", "region": region, "operation": operation, "params": params, "response": response}
+
+
+class ReplayClientTest(unittest.TestCase):
+
+    def test_matches_recorded_params_before_falling_back_to_order(self):
+        replay_client = trace_replay.ReplayClient([
+            call_record("describe_tags", {"ResourceArns": ["a"]}, {"TagDescriptions": ["a"]}),
+            call_record("describe_tags", {"ResourceArns": ["b"]}, {"TagDescriptions": ["b"]})
+        ], "us-east-1")
+        self.assertEqual(replay_client.describe_tags(ResourceArns=["b"]), {"TagDescriptions": ["b"]})
+        self.assertEqual(replay_client.describe_tags(ResourceArns=["c"]), {"TagDescriptions": ["a"]})
+
+    def test_runs_out_of_recorded_responses(self):
+        replay_client = trace_replay.ReplayClient([call_record("describe_tags", {}, {})], "us-east-1")
+        replay_client.describe_tags()
+        with self.assertRaises(lambda_function.ClientError):
+            replay_client.describe_tags()
+
+    def test_records_calls_redacted_and_with_the_region(self):
+        replay_client = trace_replay.ReplayClient([call_record("add_tags", {}, {}, region="eu-west-1")], "eu-west-1")
+        replay_client.add_tags(Tags=[{"Key": "token", "Value": "abc"}])
+        self.assertEqual(replay_client.calls, [{"region": "eu-west-1", "operation": "add_tags", "params": {"Tags": [{"Key": "token", "Value": "**REDACTED**"}]}}])
+
+    def test_paginates_on_recorded_markers(self):
+        replay_client = trace_replay.ReplayClient([
+            call_record("describe_target_groups", {}, {"TargetGroups": [1], "NextMarker": "m"}),
+            call_record("describe_target_groups", {"Marker": "m"}, {"TargetGroups": [2]})
+        ], "us-east-1")
+        pages = list(replay_client.get_paginator("describe_target_groups").paginate())
+        self.assertEqual([page["TargetGroups"] for page in pages], [[1], [2]])
+
+
+class TraceFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def test_splits_log_exports_by_invocation(self):
+        lines = []
+        for trace_id in ["req-1", "req-2"]:
+            for record in [{"type": "invocation", "event": {}}, call_record("describe_tags", {}, {}), {"type": "result", "duration_ms": 1}]:
+                lines.append(f"{lambda_function.TRACE_LOG_MARKER} {trace_id} {json.dumps(record)}")
+        path = os.path.join(self.directory, "export.log")
+        with open(path, "w") as f:
+            # Two messages on one line, the way --output text joins them
+            f.write(lines[0] + "\t" + "\n".join(lines[1:]) + "\n")
+
+        traces = trace_replay.load_traces_from_log(path)
+        self.assertEqual([trace["path"] for trace in traces], [f"{path}#req-1", f"{path}#req-2"])
+        self.assertEqual([len(trace["calls"]) for trace in traces], [1, 1])
+
+    def test_prune_keeps_the_newest_files(self):
+        for i in range(5):
+            path = os.path.join(self.directory, f"{i}.jsonl")
+            with open(path, "w") as f:
+                f.write("{}")
+            os.utime(path, (i, i))
+        lambda_function.prune_directory(self.directory, 2)
+        self.assertEqual(sorted(os.listdir(self.directory)), ["3.jsonl", "4.jsonl"])
+
+
+if __name__ == "__main__":
+    unittest.main()
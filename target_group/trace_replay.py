@@ -0,0 +1,250 @@
+"""
+Offline replay of invocation traces recorded by lambda_function (TRACE_INVOCATIONS=true or "trace": true in the event).
+
+Each trace is fed back through lambda_handler against fake clients, one per region, that serve the recorded
+responses, so no AWS calls are made. The replay reports how long the handler took and which elbv2 calls it made, and
+can be saved and compared against a later run to catch timing or API-call regressions between code versions.
+
+Traces are written to /tmp/traces in the container and also printed to its log stream, one TRACE_RECORD line
+per record. To replay from the logs, export the lines and pass --from-logs:
+    aws logs filter-log-events --log-group-name /aws/lambda/<function> --filter-pattern TRACE_RECORD \
+        --query "events[].message" --output text > export.log
+
+Usage (from this directory, with extutil and boto3 importable):
+    python trace_replay.py traces/*.jsonl --save baseline.json
+    python trace_replay.py export.log --from-logs --compare baseline.json --max-slowdown-pct 20
+"""
+import argparse
+import copy
+import difflib
+import json
+import statistics
+import sys
+import threading
+import time
+
+from collections import defaultdict, deque
+from types import SimpleNamespace
+
+import boto3
+from botocore.exceptions import ClientError
+
+import lambda_function
+
+
+def load_trace(path):
+    with open(path) as f:
+        return build_trace(path, [json.loads(line) for line in f if line.strip()])
+
+
+def load_traces_from_log(path):
+    """Splits an export of TRACE_RECORD log lines into one trace per invocation."""
+    records_by_trace = defaultdict(list)
+    with open(path) as f:
+        # --output text can put several messages on one line, so split on the marker rather than on newlines
+        for chunk in f.read().split(lambda_function.TRACE_LOG_MARKER + " ")[1:]:
+            trace_id, _, line = chunk.strip().partition(" ")
+            records_by_trace[trace_id].append(json.loads(line))
+    return [build_trace(f"{path}#{trace_id}", records) for trace_id, records in records_by_trace.items()]
+
+
+def build_trace(path, records):
+    trace = {"path": path, "invocation": None, "calls": [], "result": None}
+    for record in records:
+        if record["type"] == "invocation":
+            trace["invocation"] = record
+        elif record["type"] == "call":
+            trace["calls"].append(record)
+        elif record["type"] == "result":
+            trace["result"] = record
+    if not trace["invocation"]:
+        raise ValueError(f"{path} has no invocation record")
+    if any(record.get("truncated") for record in records):
+        raise ValueError(f"{path} has records that were too large for the log stream, replay the /tmp/traces copy instead")
+    return trace
+
+
+class ReplayClient:
+    """Stands in for one region's clients and answers each call with the recorded response for it.
+
+    A call takes the first recorded response whose operation and params match, falling back to the next one
+    recorded for the operation, so calls that ran concurrently don't have to come back in the recorded order.
+    """
+
+    def __init__(self, calls, region):
+        # Only used for its modeled exception classes, it never makes a request
+        self.exceptions = boto3.client("elbv2", region_name=region).exceptions
+        self.region = region
+        # Callers key per region caches off the client's region
+        self.meta = SimpleNamespace(region_name=region)
+        self.calls = []
+        # Regions and deregister chunks call in from worker threads
+        self._lock = threading.Lock()
+        self._responses = defaultdict(deque)
+        for call in calls:
+            self._responses[call["operation"]].append(call)
+
+    def can_paginate(self, operation_name):
+        return False
+
+    def get_paginator(self, operation_name):
+        return ReplayPaginator(getattr(self, operation_name))
+
+    def __getattr__(self, operation_name):
+        if operation_name.startswith("_"):
+            raise AttributeError(operation_name)
+
+        def call(**params):
+            redacted_params = lambda_function.redact(params)
+            with self._lock:
+                self.calls.append({"region": self.region, "operation": operation_name, "params": redacted_params})
+                queue = self._responses.get(operation_name)
+                if not queue:
+                    raise ClientError({"Error": {"Code": "ReplayMissingResponse", "Message": f"No recorded response left for {operation_name} in {self.region}"}}, operation_name)
+                record = next((item for item in queue if item["params"] == redacted_params), queue[0])
+                queue.remove(record)
+            if "error" in record:
+                error_response = {"Error": record["error"], "ResponseMetadata": {"HTTPStatusCode": record.get("status_code", 400)}}
+                raise self.exceptions.from_code(record["error"].get("Code"))(error_response, operation_name)
+            return copy.deepcopy(record["response"])
+
+        return call
+
+
+class ReplayPaginator:
+    """Follows elbv2 and ec2 pagination the way the botocore paginator does, one recorded page at a time."""
+
+    def __init__(self, method):
+        self._method = method
+
+    def paginate(self, PaginationConfig=None, **params):
+        if (PaginationConfig or {}).get("PageSize"):
+            params["PageSize"] = PaginationConfig["PageSize"]
+        while True:
+            page = self._method(**params)
+            yield page
+            # elbv2 pages with Marker/NextMarker, ec2 with NextToken
+            if page.get("NextMarker"):
+                params["Marker"] = page["NextMarker"]
+            elif page.get("NextToken"):
+                params["NextToken"] = page["NextToken"]
+            else:
+                return
+
+
+def replay(trace, repeat=1):
+    invocation = trace["invocation"]
+    function_arn = invocation.get("function_arn") or "arn:aws:lambda:us-east-1:000000000000:function:replay"
+    region = function_arn.split(":")[3]
+    context = SimpleNamespace(
+        invoked_function_arn=function_arn,
+        aws_request_id="replay",
+        function_name=function_arn.split(":")[-1],
+        get_remaining_time_in_millis=lambda: 900000
+    )
+
+    durations = []
+    for _ in range(repeat):
+        event = copy.deepcopy(invocation["event"])
+        event.pop("trace", None)
+        # The /tmp describe cache would serve or skip calls the recording has, so replay always goes to the fake client
+        (event.get("component_def") or {}).pop("describe_cache_ttl_seconds", None)
+        lambda_function.DESCRIBE_CACHE_TTL_DEFAULT = 0
+        # Each region gets its own fake client fed only with that region's recorded calls.
+        # Traces written before calls carried a region are treated as home region calls.
+        calls_by_region = defaultdict(list)
+        for call in trace["calls"]:
+            calls_by_region[call.get("region") or region].append(call)
+        fake_clients = {}
+
+        def get_fake_client(client_region):
+            if client_region not in fake_clients:
+                fake_clients[client_region] = ReplayClient(calls_by_region[client_region], client_region)
+            return fake_clients[client_region]
+
+        lambda_function.client = get_fake_client(region)
+        lambda_function.get_regional_client = get_fake_client
+        # The ec2 zone lookups share the home region's recording, their operation names don't overlap with elbv2's
+        lambda_function.get_ec2_client = lambda: get_fake_client(region)
+        # eh is shared by every @ext decorator, so reset it in place between runs
+        lambda_function.eh.__init__()
+        # Container-lifetime caches would let a later run skip calls the recording has
+        lambda_function.account_limits_cache.clear()
+        lambda_function.regional_clients.clear()
+
+        started = time.perf_counter()
+        result = lambda_function.lambda_handler(event, context)
+        durations.append((time.perf_counter() - started) * 1000)
+
+    return {
+        "trace": trace["path"],
+        "duration_ms": round(statistics.median(durations), 2),
+        "recorded_duration_ms": (trace["result"] or {}).get("duration_ms"),
+        "calls": format_calls([call for fake_client in fake_clients.values() for call in fake_client.calls], region),
+        "recorded_calls": format_calls(trace["calls"], region),
+        "result": json.loads(json.dumps(result, default=str))
+    }
+
+
+def format_call(call, default_region):
+    return f"{call.get('region') or default_region} {call['operation']} {json.dumps(call['params'], sort_keys=True, default=str)}"
+
+
+def format_calls(calls, default_region):
+    # Regions and chunks run concurrently, so calls are compared as a sorted list rather than in the order they ran
+    return sorted(format_call(call, default_region) for call in calls)
+
+
+def diff_calls(expected, actual):
+    return list(difflib.unified_diff(expected, actual, "expected", "actual", lineterm=""))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded target group invocations against recorded elbv2 responses.")
+    parser.add_argument("traces", nargs="+", help="Trace files written to /tmp/traces by lambda_function")
+    parser.add_argument("--from-logs", action="store_true", help="The files are exported TRACE_RECORD log lines, possibly covering several invocations")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per trace, the median duration is reported")
+    parser.add_argument("--save", help="Write the replay report to this file")
+    parser.add_argument("--compare", help="Compare against a report saved earlier with --save")
+    parser.add_argument("--max-slowdown-pct", type=float, default=None, help="Exit non-zero if any trace is this much slower than the compared report")
+    args = parser.parse_args(argv)
+
+    if args.from_logs:
+        traces = [trace for path in args.traces for trace in load_traces_from_log(path)]
+    else:
+        traces = [load_trace(path) for path in args.traces]
+    reports = [replay(trace, repeat=args.repeat) for trace in traces]
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {report["trace"]: report for report in json.load(f)}
+
+    failed = False
+    for report in reports:
+        print(f"{report['trace']}: {report['duration_ms']}ms handler time, {len(report['calls'])} elbv2 calls")
+        call_diff = diff_calls(report["recorded_calls"], report["calls"])
+        if call_diff:
+            print("  calls differ from the recording:")
+            print("\n".join(f"    {line}" for line in call_diff))
+
+        previous = baseline.get(report["trace"])
+        if previous:
+            change_pct = (report["duration_ms"] - previous["duration_ms"]) / max(previous["duration_ms"], 0.01) * 100
+            print(f"  vs {args.compare}: {previous['duration_ms']}ms -> {report['duration_ms']}ms ({change_pct:+.1f}%)")
+            baseline_diff = diff_calls(previous["calls"], report["calls"])
+            if baseline_diff:
+                failed = True
+                print("  calls differ from the compared report:")
+                print("\n".join(f"    {line}" for line in baseline_diff))
+            if args.max_slowdown_pct is not None and change_pct > args.max_slowdown_pct:
+                failed = True
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(reports, f, indent=2)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())